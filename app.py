@@ -1,23 +1,33 @@
-from functools import wraps
 import time
-import datetime
-import pytz  # нужно установить: pip install pytz
 
-moscow_tz = pytz.timezone("Europe/Moscow")
+_import_started = time.perf_counter()
 
-from faker import Faker
-from flask import Flask, request, jsonify
-import requests
+from functools import wraps
+import datetime
+from flask import Flask, Response, request, jsonify
 import os
 import logging
-import random
-import re
-import json
 from dotenv import load_dotenv
 from banwords import banwords
+from banword_matcher import BanwordMatcher
+from update_queue import UpdateQueue
+from update_dedup import UpdateDeduplicator, create_processed_updates_table
+from media_groups import MediaGroupAggregator
+from telegram_api import TelegramAPI
+from rate_limiter import PRIORITY_HIGH, PRIORITY_LOW, OutboundScheduler
+from chat_info import ChatInfoResolver
+from logged_msgs_store import LoggedMsgsStore
+from permission_cache import PermissionCache
+from storage import Storage
+from comment_templates import FakerPool
+from comment_store import CommentStore, create_comments_table
+from pagination import MAX_MESSAGE_LEN, PageCache, nav_keyboard, shorten
+from logger_digest import LoggerDigest
+from state_backend import StateMapping, open_state
+import metrics
+from structured_log import ChatSampler, note, setup_logging, update_record
 import threading
 from enum import IntEnum
-import sqlite3
 
 load_dotenv()
 
@@ -28,12 +38,85 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 LOGGER_CHAT_ID = os.getenv("LOGGER_CHAT_ID")
 SECRET_TOKEN = os.getenv("WEBHOOK_SECRET", "default_secret")
 BASE_URL = "https://alicerasp.alwaysdata.net/tgbot"
+# sync - обработка прямо в запросе вебхука, queue - через очередь и пул обработчиков
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "sync")
+# local - состояние в памяти процесса, sqlite - общее для нескольких WSGI-процессов
+STATE_BACKEND = os.getenv("STATE_BACKEND", "local")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+
+# Время этапов запуска в секундах (см. passenger_wsgi.py и /tgbot/stats)
+STARTUP = {}
+
+_moscow_tz = None
+
+
+def moscow_now():
+    """Текущее время по Москве; pytz импортируется при первом вызове"""
+    global _moscow_tz
+    if _moscow_tz is None:
+        import pytz  # нужно установить: pip install pytz
+
+        _moscow_tz = pytz.timezone("Europe/Moscow")
+    return datetime.datetime.now(_moscow_tz)
+
 
 # Импортируйте ваши модули
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования: запись в bot.log идет из отдельного потока через очередь.
+# С общим состоянием процессов несколько, и bot.log ротируется снаружи (logrotate)
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    path=os.getenv("LOG_FILE", "bot.log"),
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024))),
+    backups=int(os.getenv("LOG_BACKUPS", "3")),
+    shared=STATE_BACKEND != "local",
+)
 logger = logging.getLogger(__name__)
+# Полный message_data пишется для первого и каждого N-го update чата
+payload_sampler = ChatSampler(every=int(os.getenv("LOG_PAYLOAD_EVERY", "20")))
+
+
+def normalize_username(username):
+    """Username без @ и в нижнем регистре"""
+    if not username:
+        return None
+    return username.strip().lstrip("@").lower() or None
+
+
+def add_username_norm(conn):
+    """Миграция: нормализованный username с индексом для поиска"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+    if "username_norm" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN username_norm TEXT")
+    rows = conn.execute("SELECT chat_id, username FROM users").fetchall()
+    conn.executemany(
+        "UPDATE users SET username_norm = ? WHERE chat_id = ?",
+        [(normalize_username(username), chat_id) for chat_id, username in rows],
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_username_norm ON users (username_norm)"
+    )
+
+
+# Миграции users.db: новые добавляются только в конец списка
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        chat_id INTEGER PRIMARY KEY,
+        username TEXT,
+        permission INTEGER DEFAULT 0
+    )
+    """,
+    add_username_norm,
+    create_comments_table,
+    # Индекс для постраничного вывода /get_users_list
+    "CREATE INDEX IF NOT EXISTS idx_users_permission ON users (permission DESC, chat_id)",
+    create_processed_updates_table,
+]
+
+COMMENTS_PAGE_SIZE = 10
+USERS_PAGE_SIZE = 50
 
 
 class Permissions(IntEnum):
@@ -47,29 +130,21 @@ def required_permission(permission_level):
     def decorator(func):
         def wrapper(self, chat_id, *args, **kwargs):
             try:
-                result = self.cursor.execute(
-                    f"""
-                    SELECT permission
-                    from users
-                    WHERE chat_id = ?""",
-                    (chat_id,)
-                )
-                result = result.fetchone()
+                # Права берутся из кеша в памяти, без запроса к базе
+                with metrics.span("permission"):
+                    result = self.permissions.get(chat_id)
 
-                if result:
-                    logger.info(
-                        "Результат: %s, Уровень прав: %s",
-                        str(result[0]),
-                        str(permission_level),
-                    )
-                    if int(result[0]) >= int(permission_level):
+                if result is not None:
+                    note(permission=int(result), required=int(permission_level))
+                    if int(result) >= int(permission_level):
                         func(self, chat_id, *args, **kwargs)
                     else:
-                        return self.send_message(chat_id, "недостаточно прав")
+                        return self.send_message(chat_id, "недостаточно прав", wait=False)
                 else:
                     return self.send_message(
                         chat_id,
                         "пользователь не найден,используйте /start или обратитесь к разработчику",
+                        wait=False,
                     )
             except Exception as e:
                 logger.error("ошибка при проверке прав: %s", str(e))
@@ -87,33 +162,83 @@ class TelegramBot:
     def __init__(self, token, logger_chat_id, db_file):
         self.token = token
         self.logger_chat_id = logger_chat_id
-        self.base_url = f"https://api.telegram.org/bot{token}"
-        self.prev_media_groups = {}  # Словарь для отслеживания media_group_id по чатам
-        self.load_comments()
-        self.load_logged_msgs()
-        self.faker = Faker("ru_RU")
+        # Альбомы, мешки комментариев, права и logged_msgs при нескольких процессах
+        self.state = open_state(STATE_BACKEND, os.getenv("STATE_DB", "state.db"))
+        self.api = TelegramAPI(token)
+        # Все исходящие вызовы идут через планировщик с лимитами Telegram
+        self.outbound = OutboundScheduler(
+            self.api,
+            global_rate=float(os.getenv("OUTBOUND_GLOBAL_RATE", "30")),
+            group_rate=float(os.getenv("OUTBOUND_GROUP_PER_MINUTE", "20")) / 60,
+            private_rate=float(os.getenv("OUTBOUND_PRIVATE_RATE", "1")),
+        )
+        # Данные о чатах берем из update, а getChat вызываем только при промахе кеша
+        self.chat_info = ChatInfoResolver(
+            self.get_chat_info, ttl=int(os.getenv("CHAT_INFO_TTL", "600"))
+        )
+        # Части альбомов собираются здесь и комментируются один раз на альбом
+        self.media_groups = MediaGroupAggregator(
+            self.handle_album,
+            window=float(os.getenv("ALBUM_WINDOW", "1.5")),
+            state=self.state,
+        )
+        # Таблица запрещенных слов компилируется один раз при запуске
+        self.banwords = BanwordMatcher(banwords)
+        self.log_ttl = 24 * 60 * 60
+        if STATE_BACKEND == "local":
+            # Журнал вместо перезаписи всего logged_msgs.json на каждое сообщение
+            self.logged_msgs = LoggedMsgsStore("logged_msgs.json")
+        else:
+            self.logged_msgs = StateMapping(self.state, "logged_msgs", self.log_ttl)
+        # Faker создается при первом обращении (обычно в фоне, при пополнении пула)
+        self._faker = None
+        self.faker_lock = threading.Lock()
         self.faker_replace = {
             "name": lambda: self.faker.name(),
             "address": lambda: self.faker.address(),
             "phone_number": lambda: self.faker.phone_number(),
             "company": lambda: self.faker.company(),
         }
-        self.prev_media_group_id = "start"
+        # Значения для подстановок генерируются заранее в фоне
+        self.faker_pool = FakerPool(self.faker_replace)
+        self.faker_pool.refill()
         # Добавляем блокировку для потокобезопасности
         self.lock = threading.Lock()
-        # Словарь для отслеживания обработанных media_group_id
-        self.processed_media_groups = {}
-        self.last_cleanup = time.time()
+        # Очистка старых logged_msgs идет в фоне, а не в обработчике вебхука
+        self.log_janitor = None
+        self.log_janitor_lock = threading.Lock()
+        self.log_cleanup_interval = int(os.getenv("LOG_CLEANUP_INTERVAL", "60"))
+        # Итог очистки уходит в логгер-чат раз в час, а не после каждого прохода
+        self.log_cleanup_report_interval = int(os.getenv("LOG_CLEANUP_REPORT_INTERVAL", "3600"))
+        self.log_cleanup_removed = 0
+        self.log_cleanup_reported = time.monotonic()
+        # Режим сводок: зеркала сообщений уходят в логгер-чат пачками
+        self.logger_digest = None
+        if os.getenv("LOGGER_DIGEST", "0") == "1":
+            self.logger_digest = LoggerDigest(
+                lambda text: self.send_message(
+                    self.logger_chat_id, text, priority=PRIORITY_LOW
+                ),
+                self.store_digest_origins,
+                max_lines=int(os.getenv("LOGGER_DIGEST_LINES", "20")),
+                interval=float(os.getenv("LOGGER_DIGEST_INTERVAL", "10")),
+            )
         ignor_chat_ids = os.getenv("IGNORING_CHAT_IDS")
         self.ignore_chat_ids = [i.strip() for i in ignor_chat_ids.split(",")]
+        self.permissions = PermissionCache(self.state)
         self.connect_users_db(db_file)
+        # Комментарии в базе, выбор идет по копии в памяти
+        self.comments = CommentStore(self.db, state=self.state)
+        # Отрисованные страницы /comment_list и /get_users_list
+        self.page_cache = PageCache()
         self.help_msg = f"/help - помощь - доступно от {self.parse_permission_to_str(Permissions.BASE)}\n" \
                         f"/get_users_list - получить список пользователей - доступно от {self.parse_permission_to_str(Permissions.BASE)}\n" \
-                        f"/comment_list - список комментов - доступно от {self.parse_permission_to_str(Permissions.BASE)}\n" \
+                        f"/comment_list [text | photo] [страница] - список комментов - доступно от {self.parse_permission_to_str(Permissions.BASE)}\n" \
                         f"/add_comment [text | photo] [text] - доступно от {self.parse_permission_to_str(Permissions.MODER)}\n" \
                         f"/delete_comment [text | photo] [id] - доступно от {self.parse_permission_to_str(Permissions.MODER)}\n" \
                         f"/set_permission [username] [permission] - доступно от {self.parse_permission_to_str(Permissions.MODER)}\n" \
                         f"/get_user_info [chat_id | username] - доступно от {self.parse_permission_to_str(Permissions.ADMIN)}\n" \
+                        f"/check_permissions - сверить кеш прав с базой - доступно от {self.parse_permission_to_str(Permissions.DEV)}\n" \
                         f"/answer [text] - уникальная команда - доступно от логгер"
 
     @staticmethod
@@ -135,79 +260,65 @@ class TelegramBot:
         }
         return permission_map.get(permission)
 
-    def load_logged_msgs(self):
-        """Загружает logged_msgs из файла, обрабатывает ошибки"""
-        try:
-            # Проверяем существование файла
-            if not os.path.exists("logged_msgs.json"):
-                self.logged_msgs = {}
-                return
-
-            with open("logged_msgs.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
-                # Проверяем, что данные являются словарем
-                if isinstance(data, dict):
-                    self.logged_msgs = data
-                else:
-                    logger.error(
-                        "Некорректный формат данных в logged_msgs.json, ожидается словарь"
-                    )
-                    self.logged_msgs = {}
-
-        except json.JSONDecodeError as e:
-            logger.error(f"Ошибка декодирования JSON в logged_msgs.json: {e}")
-            self.logged_msgs = {}
-        except Exception as e:
-            logger.error(f"Ошибка загрузки logged_msgs: {e}")
-            self.logged_msgs = {}
-
-    def save_logged_msgs(self):
-        """Сохраняет logged_msgs в файл, обрабатывает ошибки"""
-        try:
-            # Убедимся, что logged_msgs является словарем
-            if not hasattr(self, "logged_msgs") or not isinstance(
-                self.logged_msgs, dict
-            ):
-                self.logged_msgs = {}
+    @property
+    def faker(self):
+        if self._faker is None:
+            with self.faker_lock:
+                if self._faker is None:
+                    from faker import Faker
 
-            with open("logged_msgs.json", "w", encoding="utf-8") as f:
-                json.dump(self.logged_msgs, f, ensure_ascii=False, indent=2)
-
-        except Exception as e:
-            logger.error(f"Ошибка сохранения logged_msgs: {e}")
+                    self._faker = Faker("ru_RU")
+        return self._faker
 
     def connect_users_db(self, db_file):
-        self.conn = sqlite3.connect(db_file, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                chat_id INTEGER PRIMARY KEY,
-                username TEXT,
-                permission INTEGER DEFAULT 0
-            )
-        """)
-        self.conn.commit()
+        self.db = Storage(db_file, migrations=MIGRATIONS)
+        self.permissions.load(self.db)
+        # chat_id -> [username, время последней записи] для обновления username из update
+        self.known_usernames = {
+            chat_id: [username, 0.0]
+            for chat_id, username in self.db.query("SELECT chat_id, username FROM users")
+        }
+        self.username_refresh_interval = int(os.getenv("USERNAME_REFRESH_INTERVAL", "300"))
+
+    def refresh_username(self, from_user):
+        """Обновляет username пользователя, если он сменился (не чаще интервала)"""
+        if not from_user:
+            return
+        known = self.known_usernames.get(from_user.get("id"))
+        username = from_user.get("username")
+        if known is None or known[0] == username:
+            return
+        now = time.monotonic()
+        if now - known[1] < self.username_refresh_interval:
+            return
+        known[0], known[1] = username, now
+        # Не ждем фиксации: запись уйдет вместе с ближайшей пачкой
+        self.db.submit(
+            [(
+                "UPDATE users SET username = ?, username_norm = ? WHERE chat_id = ?",
+                (username, normalize_username(username), from_user["id"]),
+            )]
+        )
+        self.page_cache.invalidate("users")
+        logger.info("Обновлен username %s: %s", from_user["id"], username)
 
     def get_user_permission(self, chat_id):
-        result = self.cursor.execute(
-            "SELECT permission FROM users WHERE chat_id = ?", (chat_id,)
-        ).fetchone()
+        result = self.permissions.get(chat_id)
 
-        if result and result[0] is not None:
-            return result[0]
+        if result is not None:
+            return result
         else:
             return Permissions.BASE  # Значение по умолчанию
 
     def get_chat_id_by_username(self, username: str):
-        if username.startswith("@"):
-            username = username[1:]
-        result = self.cursor.execute(
-            "SELECT chat_id FROM users WHERE username = ?", (username,)
-        ).fetchone()
+        username = normalize_username(username) or ""
+        result = self.db.query_one(
+            "SELECT chat_id FROM users WHERE username_norm = ?", (username,)
+        )
         if result:
             return result[0]
         else:
-            logger.error(f"Пользователь с именем {username} не найден")
+            logger.error("Пользователь с именем %s не найден", username)
             raise ValueError(f"Пользователь с именем {username} не найден")
 
     @required_permission(Permissions.MODER)
@@ -223,32 +334,27 @@ class TelegramBot:
             self.send_message(chat_id, "неверный формат команды")
             return
 
-        chat_id_to_set_permission = self.get_chat_id_by_username(
-            username_to_set_permission
-        )
-
-        if (
-            chat_id_to_set_permission is None
-            or not self.cursor.execute(
-                "SELECT 1 FROM users WHERE username = ?", (username_to_set_permission,)
-            ).fetchone()
-        ):
+        try:
+            chat_id_to_set_permission = self.get_chat_id_by_username(
+                username_to_set_permission
+            )
+        except ValueError:
             self.send_message(chat_id, "пользователь не найден")
             return
 
-        if (
-                self.get_user_permission(chat_id)
-                > self.get_user_permission(chat_id_to_set_permission)
-                and self.get_user_permission(chat_id) >= permission
-            ):
+        my_permission = self.get_user_permission(chat_id)
+        target_permission = self.get_user_permission(chat_id_to_set_permission)
+
+        if my_permission > target_permission and my_permission >= permission:
 
             try:
 
-                self.cursor.execute(
-                    f"UPDATE users SET permission = ? WHERE chat_id = ?",
+                self.db.write(
+                    "UPDATE users SET permission = ? WHERE chat_id = ?",
                     (permission, chat_id_to_set_permission),
                 )
-                self.conn.commit()
+                self.permissions.set(chat_id_to_set_permission, permission)
+                self.page_cache.invalidate("users")
                 self.send_message(chat_id, f"успешно")
                 self.send_message(
                     chat_id_to_set_permission,
@@ -256,15 +362,16 @@ class TelegramBot:
                 )
             except Exception as e:
                 self.send_message(chat_id, f"ошибка {type(e).__name__}")
-        elif (self.get_user_permission(chat_id) == Permissions.DEV and not self.get_user_permission(chat_id_to_set_permission) == Permissions.DEV)\
+        elif (my_permission == Permissions.DEV and not target_permission == Permissions.DEV)\
             or str(chat_id) == str(self.logger_chat_id):
             try:
 
-                self.cursor.execute(
-                    f"UPDATE users SET permission = ? WHERE chat_id = ?",
+                self.db.write(
+                    "UPDATE users SET permission = ? WHERE chat_id = ?",
                     (permission, chat_id_to_set_permission),
                 )
-                self.conn.commit()
+                self.permissions.set(chat_id_to_set_permission, permission)
+                self.page_cache.invalidate("users")
                 self.send_message(chat_id, f"успешно")
                 self.send_message(
                     chat_id_to_set_permission,
@@ -281,158 +388,243 @@ class TelegramBot:
             if isinstance(permission, str):
                 permission = self.parse_permission(permission)
 
-            self.cursor.execute(
-                "INSERT OR IGNORE INTO users (chat_id, username, permission) VALUES (?, ?, ?)",
-                (chat_id, username, permission),
+            # Запись фиксируется вместе с другими, пришедшими одновременно
+            result = self.db.write(
+                "INSERT OR IGNORE INTO users (chat_id, username, username_norm, permission) VALUES (?, ?, ?, ?)",
+                (chat_id, username, normalize_username(username), permission),
             )
-            self.conn.commit()
 
             # Проверяем, была ли выполнена вставка
-            if self.cursor.rowcount > 0:
-                logger.info(f"Добавлен новый пользователь: {chat_id}, {username}")
+            if result.rowcount > 0:
+                self.permissions.set(chat_id, permission or Permissions.BASE)
+                self.page_cache.invalidate("users")
+                self.known_usernames[chat_id] = [username, time.monotonic()]
+                logger.info("Добавлен новый пользователь: %s, %s", chat_id, username)
                 return True
             else:
-                logger.info(f"Пользователь уже существует: {chat_id}")
+                logger.info("Пользователь уже существует: %s", chat_id)
                 return False
 
         except Exception as e:
-            logger.error(f"Ошибка добавления пользователя {chat_id}: {e}")
+            logger.error("Ошибка добавления пользователя %s: %s", chat_id, e)
             return False
 
-    def load_comments(self):
-        with open("comments.json", "r", encoding="utf-8") as f:
-            comment_data = json.load(f)
-            self.text_comments = comment_data["text"]
-            self.photo_comments = comment_data["photo"]
-
-    def save_comments(self):
-        with open("comments.json", "w") as f:
-            json.dump({"text": self.text_comments, "photo": self.photo_comments}, f)
+    def send_message(
+        self, chat_id, text, reply_to_message_id=None, reply_markup=None,
+        priority=PRIORITY_HIGH, wait=True,
+    ):
+        """Отправка сообщения.
 
-    def send_message(self, chat_id, text, reply_to_message_id=None):
-        """Отправка сообщения"""
-        url = f"{self.base_url}/sendMessage"
+        С wait=False результат не ждем: последнее такое сообщение может
+        уйти прямо в ответе на вебхук, без отдельного запроса к Telegram.
+        """
         payload = {"chat_id": chat_id, "text": text}
         if reply_to_message_id:
             payload["reply_to_message_id"] = reply_to_message_id
+        if reply_markup:
+            payload["reply_markup"] = reply_markup
 
         try:
-            response = requests.post(url, json=payload)
-            logger.info(f"Отправлено сообщение в чат {chat_id}: {text[:50]}...")
-            return response.json()
+            if not wait:
+                self.outbound.defer("sendMessage", payload, chat_id, priority)
+                logger.debug("Сообщение в чат %s поставлено в очередь: %.50s", chat_id, text)
+                return None
+            # Замеряется только ожидание: очередь планировщика плюс запрос к Telegram
+            with metrics.span("send_message"):
+                result = self.outbound.call("sendMessage", payload, chat_id, priority)
+            logger.debug("Отправлено сообщение в чат %s: %.50s", chat_id, text)
+            return result
         except Exception as e:
-            logger.error(f"Ошибка отправки: {e}")
+            logger.error("Ошибка отправки: %s", e)
             return None
 
+    def edit_message_text(self, chat_id, message_id, text, reply_markup=None):
+        """Замена текста сообщения (перелистывание страниц)"""
+        payload = {"chat_id": chat_id, "message_id": message_id, "text": text}
+        if reply_markup:
+            payload["reply_markup"] = reply_markup
+        try:
+            return self.outbound.call("editMessageText", payload, chat_id)
+        except Exception as e:
+            logger.error("Ошибка редактирования сообщения: %s", e)
+            return None
+
+    def answer_callback_query(self, callback_query_id, text=None):
+        """Ответ на нажатие inline-кнопки"""
+        payload = {"callback_query_id": callback_query_id}
+        if text:
+            payload["text"] = text
+        try:
+            return self.outbound.call("answerCallbackQuery", payload)
+        except Exception as e:
+            logger.error("Ошибка ответа на callback: %s", e)
+            return None
+
+    def show_page(self, chat_id, page, message_id=None):
+        """Отправляет страницу списка или заменяет ею уже отправленную"""
+        text, reply_markup = page
+        if message_id:
+            return self.edit_message_text(chat_id, message_id, text, reply_markup)
+        return self.send_message(chat_id, text, reply_markup=reply_markup)
+
     def set_message_reaction(self, chat_id, message_id):
-        """Установка реакции на сообщение"""
-        url = f"{self.base_url}/setMessageReaction"
+        """Установка реакции на сообщение без ожидания ответа"""
         payload = {
             "chat_id": chat_id,
             "message_id": message_id,
             "reaction": [{"type": "emoji", "emoji": "🗿"}],
         }
         try:
-            response = requests.post(url, json=payload)
-            logger.info(
-                f"Установлена реакция на сообщение {message_id} в чате {chat_id}"
-            )
-            if response.status_code == 429:
-                retry_after = (
-                    response.json().get("parameters", {}).get("retry_after", 5)
-                )
-                logger.warning(
-                    f"Превышено ограничение частоты. Ждем {retry_after} секунд."
-                )
-                time.sleep(retry_after)
-                self.set_message_reaction(chat_id, message_id)
-            return response.json()
+            # Обработчик не ждет реакцию: ошибки пишет в лог планировщик,
+            # 429 он же обрабатывает повтором. Лимит сообщений чата реакция не тратит
+            self.outbound.send("setMessageReaction", payload, chat_id)
         except Exception as e:
-            logger.error(f"Ошибка установки реакции: {e}")
-            return None
+            logger.error("Ошибка установки реакции: %s", e)
+
+    def ensure_log_janitor(self):
+        """Запускает фоновую очистку старых логов, если она еще не запущена"""
+        with self.log_janitor_lock:
+            if self.log_janitor is None or not self.log_janitor.is_alive():
+                self.log_janitor = threading.Thread(
+                    target=self.log_janitor_loop, name="logged-msgs-janitor", daemon=True
+                )
+                self.log_janitor.start()
+
+    def log_janitor_loop(self):
+        while True:
+            time.sleep(self.log_cleanup_interval)
+            try:
+                self.cleanup_old_logs()
+            except Exception as e:
+                logger.error("Ошибка очистки старых логов: %s", e)
 
     def cleanup_old_logs(self):
         """Очистка старых логов"""
-        current_time = time.time()
-        if current_time - self.last_cleanup > 3600:  # Каждый час
-            # Удаляем записи старше 24 часов
-            keys_to_remove = []
-            for key, value in self.logged_msgs.items():
-                if (current_time - value.get("timestamp", 0)) > 24 * 60 * 60:
-                    keys_to_remove.append(key)
-
-            for key in keys_to_remove:
-                del self.logged_msgs[key]
-
-            self.last_cleanup = current_time
-            if keys_to_remove:
-                logger.info(f"Очищено {len(keys_to_remove)} старых логов")
-                self.send_message(
-                    self.logger_chat_id,
-                    f"Очищено {len(keys_to_remove)} старых логов",
-                )
-                self.save_logged_msgs()
+        # Удаляем записи старше 24 часов: из кучи достаются только устаревшие
+        removed = self.logged_msgs.expire(time.time() - self.log_ttl)
+        if removed:
+            logger.info("Очищено %s старых логов", len(removed))
+            self.log_cleanup_removed += len(removed)
+        now = time.monotonic()
+        if now - self.log_cleanup_reported < self.log_cleanup_report_interval:
+            return
+        self.log_cleanup_reported = now
+        if self.log_cleanup_removed:
+            self.send_message(
+                self.logger_chat_id,
+                f"Очищено {self.log_cleanup_removed} старых логов",
+                priority=PRIORITY_LOW,
+            )
+            self.log_cleanup_removed = 0
+
+    @metrics.timed("mirror_to_logger")
+    def mirror_to_logger(self, text, chat_id, message_id):
+        """Зеркалирует сообщение в логгер-чат и запоминает источник для /answer.
+
+        Отправка не ждет ответа: лимит логгер-чата не задерживает вебхук,
+        источник сохраняется в колбэке после отправки, как у сводок.
+        """
+        if self.logger_digest is not None:
+            # Строка уйдет в ближайшей сводке, источник сохранится после отправки
+            self.logger_digest.add(
+                text, {"chat_id": chat_id, "message_id": message_id}
+            )
+            return
+        future = self.outbound.submit(
+            "sendMessage",
+            {"chat_id": self.logger_chat_id, "text": text},
+            self.logger_chat_id,
+            PRIORITY_LOW,
+        )
+        future.add_done_callback(
+            lambda done: self.store_mirror_origin(done, chat_id, message_id)
+        )
+
+    def store_mirror_origin(self, future, chat_id, message_id):
+        """Сохраняет источник зеркала, когда логгер-чат подтвердил отправку"""
+        try:
+            msg = future.result()
+        except Exception as e:
+            logger.error("Ошибка зеркалирования в логгер-чат: %s", e)
+            return
+        if not msg.get("ok"):
+            logger.warning("Зеркало не отправлено в логгер-чат: %s", msg)
+            return
+        bot_msg_id = msg["result"]["message_id"]
+        # Сохраняем с timestamp
+        self.logged_msgs[str(bot_msg_id)] = {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "timestamp": time.time(),
+        }
+        self.ensure_log_janitor()  # Периодическая очистка в фоне
+
+    def store_digest_origins(self, bot_msg_id, origins):
+        """Сохраняет источники строк сводки под ключами <id сводки>#<номер строки>"""
+        now = time.time()
+        for num, origin in enumerate(origins, start=1):
+            self.logged_msgs[f"{bot_msg_id}#{num}"] = {**origin, "timestamp": now}
+        self.ensure_log_janitor()
 
+    @metrics.timed("process_message")
     def process_message(self, message_data):
         """Обработка входящего сообщения"""
         try:
-            logger.info(f"Получено сообщение: {message_data}")
             chat_id = message_data["chat"]["id"]
             chat_type = message_data["chat"]["type"]
             message_id = message_data["message_id"]
             text = message_data.get("text", "")
 
-            logger.info(
-                f"Обработка сообщения: чат {chat_id}, тип {chat_type}, текст: {text}"
-            )
+            note(chat_id=chat_id, chat_type=chat_type, message_id=message_id, text=text[:200])
+            if payload_sampler.take(chat_id):
+                note(payload=message_data)
+            self.refresh_username(message_data.get("from"))
 
             # Обработка команды /start
             if text == "/start":
-                return self.handle_start_command(chat_id, chat_type)
+                return self.handle_start_command(chat_id, chat_type, message_data)
 
             # Обработка сообщений в группах
             elif chat_type in ["group", "supergroup"]:
                 if str(chat_id) in [x for x in map(str, self.ignore_chat_ids)]:
-                    return self.send_message(chat_id, "я не буду здесь работать")
+                    return self.send_message(chat_id, "я не буду здесь работать", wait=False)
 
                 return self.handle_group_message(message_data)
 
             # Обработка личных сообщений
             elif chat_type == "private":
-                msg = self.send_message(
-                    self.logger_chat_id,
-                    f"[{datetime.datetime.now(moscow_tz).strftime('%H:%M:%S')} : @{self.get_chat_info(chat_id).get('username', 'неизвестно')} ({chat_id}), {text}]",
+                self.mirror_to_logger(
+                    f"[{moscow_now().strftime('%H:%M:%S')} : @{(self.chat_info.get(chat_id, message_data) or {}).get('username', 'неизвестно')} ({chat_id}), {text}]",
+                    chat_id,
+                    message_id,
+                )
+                # Ответ пользователю не зависит от того, дошло ли зеркало
+                return self.handle_private_message(
+                    chat_id, text, message_id, message_data
                 )
-                if msg and msg.get("ok"):
-                    bot_msg_id = msg.get("result").get("message_id")
-                    # Сохраняем с timestamp
-                    self.logged_msgs[str(bot_msg_id)] = {
-                        "chat_id": chat_id,
-                        "message_id": message_id,
-                        "timestamp": time.time(),
-                    }
-                    self.save_logged_msgs()
-                    self.cleanup_old_logs()  # Периодическая очистка
-                    return self.handle_private_message(
-                        chat_id, text, message_id, message_data
-                    )
 
         except Exception as e:
-            logger.error(f"Ошибка обработки сообщения: {e}")
+            note(error=f"{type(e).__name__}: {e}")
+            logger.error("Ошибка обработки сообщения: %s", e)
 
-    def handle_start_command(self, chat_id, chat_type):
+    def handle_start_command(self, chat_id, chat_type, message_data=None):
         """Обработка команды /start"""
         if chat_type == "private":
             self.send_message(
                 chat_id,
                 "Привет! Я бот для управления комментариями. Используйте команды для добавления и удаления комментариев.",
+                wait=False,
+            )
+            self.add_user(
+                chat_id,
+                (self.chat_info.get(chat_id, message_data) or {}).get("username"),
             )
-            self.add_user(chat_id, self.get_chat_info(chat_id).get("username"))
 
         else:
             self.send_message(
                 chat_id,
                 "Привет! Я бот этой группы. Я реагирую на пересланные сообщения и слежу за запрещенными словами.",
+                wait=False,
             )
 
     @required_permission(Permissions.MODER)
@@ -444,48 +636,60 @@ class TelegramBot:
             comment_type = text.split()[1]
             comment_text = " ".join(text.split()[2:])
             if comment_type == "text":
-                self.text_comments.append(comment_text)
+                comment_id = self.comments.add("text", comment_text, created_by=chat_id)
                 self.send_message(
-                    chat_id, f"Добавлен текстовый комментарий: {comment_text}"
+                    chat_id, f"Добавлен текстовый комментарий №{comment_id}: {comment_text}"
                 )
             elif comment_type == "photo":
-                self.photo_comments.append(comment_text)
-                self.send_message(chat_id, f"Добавлен фото-комментарий: {comment_text}")
+                comment_id = self.comments.add("photo", comment_text, created_by=chat_id)
+                self.send_message(
+                    chat_id, f"Добавлен фото-комментарий №{comment_id}: {comment_text}"
+                )
             else:
                 self.send_message(
                     chat_id,
                     "Неверный тип комментария. Используйте /add_comment text или /add_comment photo",
                 )
-                return
-            self.save_comments()
 
     @required_permission(Permissions.BASE)
-    def handle_list_comment(self, chat_id):
-        msg = []
-        num = 1
-        for i in self.text_comments:
+    def handle_list_comment(self, chat_id, kind="text", page=0, message_id=None):
+        if kind not in ("text", "photo"):
+            kind = "text"
+        self.show_page(chat_id, self.render_comment_page(kind, page), message_id)
+
+    def render_comment_page(self, kind, page):
+        """Страница списка комментариев: (текст, клавиатура)"""
+        comments = self.comments.list(kind)
+        pages = max(1, -(-len(comments) // COMMENTS_PAGE_SIZE))
+        page = min(max(0, page), pages - 1)
+        key = ("comments", kind, page)
+        cached = self.page_cache.get(key, self.comments.rev)
+        if cached:
+            return cached
+
+        title = "ТЕКСТ" if kind == "text" else "ФОТО"
+        msg = [f"{title} ({page + 1}/{pages})".center(40, "=")]
+        start = page * COMMENTS_PAGE_SIZE
+        for num, i in comments[start : start + COMMENTS_PAGE_SIZE]:
             msg.append(
-                f"{num}. {i}"
+                f"{num}. {shorten(i.text, 180)}"
                 + (
-                    ("( " + self.parse_comment(i, re.findall(r"{{\w+}}", i)) + " )")
-                    if re.findall(r"{{\w+}}", i)
+                    ("( " + shorten(self.parse_comment(i), 180) + " )")
+                    if i.placeholders
                     else ""
                 )
             )
-            num += 1
-        msg.append("ФОТО".center(60, "="))
-        num = 1
-        for i in self.photo_comments:
-            msg.append(
-                f"{num}. {i}"
-                + (
-                    ("( " + self.parse_comment(i, re.findall(r"{{\w+}}", i)) + " )")
-                    if re.findall(r"{{\w+}}", i)
-                    else ""
-                )
-            )
-            num += 1
-        self.send_message(chat_id, "\n".join(msg))
+        other = "photo" if kind == "text" else "text"
+        result = (
+            shorten("\n".join(msg), MAX_MESSAGE_LEN),
+            nav_keyboard(
+                f"cl:{kind}:{page - 1}" if page > 0 else None,
+                f"cl:{kind}:{page + 1}" if page + 1 < pages else None,
+                [("ФОТО" if other == "photo" else "ТЕКСТ", f"cl:{other}:0")],
+            ),
+        )
+        self.page_cache.put(key, self.comments.rev, result)
+        return result
 
     @required_permission(Permissions.MODER)
     def handle_delete_comment(self, chat_id, text):
@@ -494,37 +698,20 @@ class TelegramBot:
             return
         comment_type = text.split()[1]
         del_num = text.split()[2]
-        if del_num.isdigit():
+        if comment_type not in ("text", "photo"):
+            self.send_message(chat_id, "Неверный тип комментария (text или photo)")
+        elif del_num.isdigit():
+            # Номер - постоянный id комментария, номера других не сдвигаются
             del_num = int(del_num)
-            if comment_type == "text":
-                if del_num <= len(self.text_comments):
-                    del_txt = self.text_comments[del_num - 1]
-                    self.text_comments.pop(del_num - 1)
-                    self.save_comments()
-                    self.send_message(
-                        chat_id, f"Комментарий №{del_num} ({del_txt}) удален"
-                    )
-                    return
-                else:
-                    self.send_message(
-                        chat_id, "Нет такого номера. используй /comment_list"
-                    )
-                    return
-
-            elif comment_type == "photo":
-                if del_num <= len(self.photo_comments):
-                    del_txt = self.photo_comments[del_num - 1]
-                    self.photo_comments.pop(del_num - 1)
-                    self.save_comments()
-                    self.send_message(
-                        chat_id, f"Комментарий №{del_num} ({del_txt}) удален"
-                    )
-                    return
-                else:
-                    self.send_message(
-                        chat_id, "Нет такого номера. используй /comment_list"
-                    )
-                    return
+            deleted = self.comments.delete(comment_type, del_num)
+            if deleted is not None:
+                self.send_message(
+                    chat_id, f"Комментарий №{del_num} ({deleted.text}) удален"
+                )
+            else:
+                self.send_message(
+                    chat_id, "Нет такого номера. используй /comment_list"
+                )
         else:
             self.send_message(chat_id, "Введите число")
 
@@ -532,15 +719,17 @@ class TelegramBot:
     def handle_get_user_info(self, chat_id, text):
         if str(chat_id) == str(self.logger_chat_id):
             find_chat = text.split()[1]
-            if isinstance(find_chat, str):
+            if find_chat.lstrip("-").isdigit():
+                find_chat = int(find_chat)
+            else:
                 try:
                     find_chat = self.get_chat_id_by_username(find_chat)
                 except ValueError:
                     return self.send_message(chat_id, "Пользователь не найден")
             if find_chat is None:
                 return self.send_message(chat_id, "Пользователь не найден")
-            user_info = self.get_chat_info(find_chat)
-            logger.info(find_chat, user_info, chat_id)
+            user_info = self.chat_info.get(find_chat)
+            logger.info("Данные по чату %s для %s: %s", find_chat, chat_id, user_info)
             self.send_message(
                 self.logger_chat_id,
                 f"данные по чату {find_chat}:\nID: {user_info['id']}\nИмя: {user_info.get('first_name', 'Не указано')}\nФамилия: {user_info.get('last_name', 'Не указана')}\nUsername: @{user_info.get('username', 'Не указан')}",
@@ -570,7 +759,17 @@ class TelegramBot:
         replied_message_id_str = str(replied_message_id)
 
         # Проверяем, есть ли такой message_id в logged_msgs
-        if replied_message_id_str not in self.logged_msgs:
+        parts = text.split(" ", 2)
+        if replied_message_id_str in self.logged_msgs:
+            key = replied_message_id_str
+            answer_parts = text.split(" ", 1)[1:]  # Берем текст после "/answer "
+        elif len(parts) > 1 and parts[1].isdigit():
+            # Ответ на сводку: "/answer <номер строки> текст"
+            key = f"{replied_message_id_str}#{parts[1]}"
+            answer_parts = parts[2:]
+        else:
+            key = None
+        if key is None or key not in self.logged_msgs:
             self.send_message(
                 chat_id, "Сообщение, на которое вы ответили, не найдено в логах"
             )
@@ -578,20 +777,23 @@ class TelegramBot:
 
         # Получаем данные для ответа
         try:
-            data = self.logged_msgs[replied_message_id_str]
+            data = self.logged_msgs[key]
             answer_chat_id = data["chat_id"]
             answer_msg_id = data["message_id"]
-            answer = text.split(" ", 1)[1]  # Берем текст после "/answer "
+            answer = answer_parts[0]
 
             # Отправляем ответ
             self.send_message(answer_chat_id, answer, reply_to_message_id=answer_msg_id)
             self.send_message(chat_id, "Ответ отправлен")
         except IndexError:
-            self.send_message(chat_id, "Используйте: /answer [текст ответа]")
+            self.send_message(
+                chat_id,
+                "Используйте: /answer [текст ответа], для сводки - /answer [номер строки] [текст ответа]",
+            )
         except Exception as e:
-            logger.error(f"Ошибка отправки ответа: {e}")
+            logger.error("Ошибка отправки ответа: %s", e)
             self.send_message(chat_id, "Ошибка при отправке ответа")
-    
+
     @required_permission(Permissions.MODER)
     def handle_set_permission(self, chat_id, text):
         try:
@@ -617,27 +819,115 @@ class TelegramBot:
             )
 
     @required_permission(Permissions.BASE)
-    def handle_get_users_list(self,chat_id):
-        result = self.cursor.execute("SELECT username,permission FROM users ORDER BY permission DESC").fetchall()
+    def handle_get_users_list(self, chat_id, cursor="first", message_id=None):
+        self.show_page(chat_id, self.render_users_page(cursor), message_id)
+
+    def render_users_page(self, cursor):
+        """Страница списка пользователей по ключу (permission, chat_id).
+
+        cursor: "first", "n:<permission>:<chat_id>" - строки после ключа,
+        "p:<permission>:<chat_id>" - строки перед ключом.
+        """
+        key = ("users", cursor)
+        cached = self.page_cache.get(key, None)
+        if cached:
+            return cached
+
+        limit = USERS_PAGE_SIZE + 1
+        direction, _, position = cursor.partition(":")
+        if direction == "n":
+            permission, last_id = map(int, position.split(":"))
+            rows = self.db.query(
+                "SELECT chat_id, username, permission FROM users "
+                "WHERE permission < ? OR (permission = ? AND chat_id > ?) "
+                "ORDER BY permission DESC, chat_id LIMIT ?",
+                (permission, permission, last_id, limit),
+            )
+            has_prev, has_next = True, len(rows) == limit
+            rows = rows[:USERS_PAGE_SIZE]
+        elif direction == "p":
+            permission, first_id = map(int, position.split(":"))
+            rows = self.db.query(
+                "SELECT chat_id, username, permission FROM users "
+                "WHERE permission > ? OR (permission = ? AND chat_id < ?) "
+                "ORDER BY permission ASC, chat_id DESC LIMIT ?",
+                (permission, permission, first_id, limit),
+            )
+            has_prev, has_next = len(rows) == limit, True
+            rows = rows[:USERS_PAGE_SIZE][::-1]
+        else:
+            rows = self.db.query(
+                "SELECT chat_id, username, permission FROM users "
+                "ORDER BY permission DESC, chat_id LIMIT ?",
+                (limit,),
+            )
+            has_prev, has_next = False, len(rows) == limit
+            rows = rows[:USERS_PAGE_SIZE]
+
         msg = [f"Список пользователей:"]
-        for i in result:
-            msg.append(f"@{i[0]} - {self.parse_permission_to_str(i[1])}")
+        for i in rows:
+            msg.append(f"@{i[1]} - {self.parse_permission_to_str(i[2])}")
+        result = (
+            shorten("\n".join(msg), MAX_MESSAGE_LEN),
+            nav_keyboard(
+                f"ul:p:{rows[0][2]}:{rows[0][0]}" if rows and has_prev else None,
+                f"ul:n:{rows[-1][2]}:{rows[-1][0]}" if rows and has_next else None,
+            ),
+        )
+        self.page_cache.put(key, None, result)
+        return result
+
+    @metrics.timed("process_callback")
+    def process_callback(self, callback_query):
+        """Обработка нажатий inline-кнопок навигации"""
+        data = callback_query.get("data", "")
+        message = callback_query.get("message") or {}
+        chat_id = message.get("chat", {}).get("id")
+        message_id = message.get("message_id")
+        self.answer_callback_query(callback_query["id"])
+        if chat_id is None:
+            return
+        try:
+            if data.startswith("cl:"):
+                _, kind, page = data.split(":")
+                self.handle_list_comment(chat_id, kind, int(page), message_id=message_id)
+            elif data.startswith("ul:"):
+                self.handle_get_users_list(chat_id, data[3:], message_id=message_id)
+            else:
+                logger.info("Неизвестный callback: %s", data)
+        except ValueError:
+            logger.warning("Некорректный callback: %s", data)
+
+    @required_permission(Permissions.DEV)
+    def handle_check_permissions(self, chat_id):
+        """Сверка кеша прав с базой"""
+        mismatches = self.permissions.check(self.db)
+        if not mismatches:
+            self.send_message(chat_id, "Кеш прав совпадает с базой")
+            return
+        msg = [f"Расхождений: {len(mismatches)}, кеш перезагружен"]
+        for find_chat, cached, stored in mismatches[:50]:
+            msg.append(f"{find_chat}: кеш {cached}, база {stored}")
+        self.permissions.load(self.db)
         self.send_message(chat_id, "\n".join(msg))
 
     @required_permission(Permissions.BASE)
     def handle_help(self, chat_id):
-        self.send_message(chat_id, self.help_msg)
+        self.send_message(chat_id, self.help_msg, wait=False)
 
     def handle_private_message(self, chat_id, text, message_id, message_data):
         """Обработка личных сообщений"""
         if text and not text.startswith("/"):
             self.send_message(
-                chat_id, f"Вы написали: {text}", reply_to_message_id=message_id
+                chat_id, f"Вы написали: {text}", reply_to_message_id=message_id, wait=False
             )
         elif text.startswith("/add_comment"):
             self.handle_add_comment(chat_id, text)
         elif text.startswith("/comment_list"):
-            self.handle_list_comment(chat_id)
+            args = text.split()[1:]
+            kind = args[0] if args else "text"
+            page = int(args[1]) - 1 if len(args) > 1 and args[1].isdigit() else 0
+            self.handle_list_comment(chat_id, kind, page)
         elif text.startswith("/delete_comment"):
             self.handle_delete_comment(chat_id, text)
         elif text.startswith("/get_user_info"):
@@ -648,6 +938,8 @@ class TelegramBot:
             self.handle_set_permission(chat_id, text)
         elif text.startswith("/get_users_list"):
             self.handle_get_users_list(chat_id)
+        elif text.startswith("/check_permissions"):
+            self.handle_check_permissions(chat_id)
         elif text.startswith("/help"):
             self.handle_help(chat_id)
     def get_forwarded_channel_info(self, message_data):
@@ -657,7 +949,7 @@ class TelegramBot:
 
 
         except Exception as e:
-            logger.error(f"Ошибка получения информации о канале: {e}")
+            logger.error("Ошибка получения информации о канале: %s", e)
             return None
 
     def handle_group_message(self, message_data):
@@ -667,217 +959,318 @@ class TelegramBot:
         text = message_data.get("text", "")
         caption = message_data.get("caption", "")
 
-        logger.info(
-            f"Группа '{message_data['chat'].get('title', 'Unknown')}': сообщение {message_id}"
-        )
-        logger.info(f"Текст: {text}, Подпись: {caption}")
-        logger.info(f"Ключи сообщения: {list(message_data.keys())}")
-
         # Проверка на пересланные сообщения (из каналов или других чатов)
         is_forwarded = any(key.startswith("forward") for key in message_data.keys())
-        logger.info(f"Сообщение переслано: {is_forwarded}")
+        note(chat_title=message_data["chat"].get("title"), forwarded=is_forwarded)
+        if caption:
+            note(caption=caption[:200])
 
         if is_forwarded:
-            logger.info("Обнаружено пересланное сообщение!")
             return self.handle_forwarded_message(message_data)
         else:
             # Проверка запрещенных слов в обычных сообщениях
             if text:
                 return self.check_banwords(chat_id, text, message_id)
 
-    def parse_comment(self, comment, refind):
-        for i in refind:
-            comment = comment.replace(
-                i,
-                self.faker_replace[i.replace("{{", "").replace("}}", "")](),
-            )
-        return comment
+    def parse_comment(self, comment):
+        """Текст комментария с подставленными значениями"""
+        return comment.render(self.faker_pool)
 
     def handle_forwarded_message(self, message_data):
         """Обработка пересланных сообщений"""
-        logger.info("handle_forwarded_message")
         chat_id = message_data["chat"]["id"]
         message_id = message_data["message_id"]
         media_group_id = message_data.get("media_group_id")
         caption = message_data.get("caption", "")
-        msg = self.send_message(
-            self.logger_chat_id,
-            f"СООБЩЕНИЕ ИЗ КАНАЛА {self.get_forwarded_channel_info(message_data)} \n[{datetime.datetime.now(moscow_tz).strftime('%H:%M:%S')} : @{self.get_chat_info(chat_id).get('username', 'неизвестно')} ({chat_id}), {caption or message_data.get('text', 'нет текста')}]",
-        )
-        if msg and msg.get("ok"):
-            bot_msg_id = msg.get("result").get("message_id")
-            # Сохраняем с timestamp
-            self.logged_msgs[str(bot_msg_id)] = {
-                "chat_id": chat_id,
-                "message_id": message_id,
-                "timestamp": time.time(),
-            }
-            self.save_logged_msgs()
-            self.cleanup_old_logs()  # Периодическая очистка
-
-        if not hasattr(self, "prevcomment"):
-            self.prevcomment = ""
-
-        logger.info(
-            f"Обработка пересланного сообщения. media_group_id: {media_group_id}"
+        self.mirror_to_logger(
+            f"СООБЩЕНИЕ ИЗ КАНАЛА {self.get_forwarded_channel_info(message_data)} \n[{moscow_now().strftime('%H:%M:%S')} : @{(self.chat_info.get(chat_id, message_data) or {}).get('username', 'неизвестно')} ({chat_id}), {caption or message_data.get('text', 'нет текста')}]",
+            chat_id,
+            message_id,
         )
 
-        # Если есть media_group_id, это альбом
+        # Если есть media_group_id, это альбом: ждем остальные части в фоне
         if media_group_id:
-            # Ждем 1.5 секунды, чтобы все сообщения из альбома успели прийти
-            time.sleep(1.5)
-
-            # Инициализация словаря для хранения типов альбомов, если его еще нет
-            if not hasattr(self, "album_types"):
-                self.album_types = {}
-
-            # Определяем, является ли это сообщением с подписью
-            has_caption = bool(caption)
-
-            # Получаем текущий тип альбома (если уже определен)
-            album_type = self.album_types.get(media_group_id)
-
-            if has_caption:
-                # Это альбом с подписью
-                self.album_types[media_group_id] = "with_caption"
-                logger.info(f"Альбом с подписью: {media_group_id}")
-            elif not has_caption and not album_type:
-                # Это первое сообщение альбома без подписи
-                self.album_types[media_group_id] = "without_caption"
-                logger.info(f"Альбом без подписи: {media_group_id}")
-            elif not has_caption and album_type:
-                # Это продолжение альбома - пропускаем
-                logger.info("Продолжение альбома, пропускаем")
-                return
+            note(media_group_id=media_group_id)
+            self.media_groups.add(media_group_id, message_data)
+            return
 
-            # Очищаем старые записи (старше 30 секунд)
-            current_time = time.time()
-            if not hasattr(self, "album_timestamps"):
-                self.album_timestamps = {}
+        self.comment_forwarded_message(message_data)
 
-            self.album_timestamps[media_group_id] = current_time
+    def handle_album(self, media_group_id, parts):
+        """Реакция и комментарий на альбом целиком"""
+        # Комментируем часть с подписью, если она есть, иначе первую часть альбома
+        captioned = [part for part in parts if part.get("caption")]
+        target = min(captioned or parts, key=lambda part: part["message_id"])
+        logger.info(
+            "Альбом %s: %s частей, %s",
+            media_group_id,
+            len(parts),
+            "с подписью" if captioned else "без подписи",
+        )
+        self.comment_forwarded_message(target)
 
-            # Удаляем записи старше 30 секунд
-            for mgid in list(self.album_types.keys()):
-                if (
-                    mgid not in self.album_timestamps
-                    or current_time - self.album_timestamps[mgid] > 30
-                ):
-                    if mgid in self.album_types:
-                        del self.album_types[mgid]
-                    if mgid in self.album_timestamps:
-                        del self.album_timestamps[mgid]
+    @metrics.timed("comment_forwarded")
+    def comment_forwarded_message(self, message_data):
+        """Реакция и комментарий на пересланное сообщение"""
+        chat_id = message_data["chat"]["id"]
+        message_id = message_data["message_id"]
 
         # Установка реакции
-        reaction_result = self.set_message_reaction(chat_id, message_id)
-        if reaction_result and not reaction_result.get("ok"):
-            logger.warning(f"Не удалось установить реакцию: {reaction_result}")
+        self.set_message_reaction(chat_id, message_id)
 
-        # Выбор типа комментария
+        # Выбор комментария без повторов в пределах чата
         if any(media_type in message_data for media_type in ["photo", "video"]):
-            comment = random.choice(self.photo_comments)
+            comment = self.comments.pick(chat_id, "photo")
         else:
-            comment = random.choice(self.text_comments)
-
-        # Избегаем повторения предыдущего комментария
-        while comment == self.prevcomment and (
-            len(self.photo_comments) > 1 or len(self.text_comments) > 1
-        ):
-            logger.info("идет подбор комментария")
-            if any(media_type in message_data for media_type in ["photo", "video"]):
-                comment = random.choice(self.photo_comments)
-            else:
-                comment = random.choice(self.text_comments)
+            comment = self.comments.pick(chat_id, "text")
+        if comment is None:
+            logger.warning("Нет комментариев для ответа")
+            return
 
         # Замена шаблонов в комментарии
-        if re.findall(r"{{\w+}}", comment):
-            comment = self.parse_comment(comment, re.findall(r"{{\w+}}", comment))
-
-        # Сохраняем текущий комментарий как предыдущий
-        self.prevcomment = comment
+        comment = self.parse_comment(comment)
 
-        logger.info(f"Отправка комментария: {comment}")
-        self.send_message(chat_id, comment, reply_to_message_id=message_id)
+        note(comment=comment[:200])
+        logger.debug("Отправка комментария: %s", comment)
+        self.send_message(chat_id, comment, reply_to_message_id=message_id, wait=False)
 
+    @metrics.timed("get_chat")
     def get_chat_info(self, chat_id):
         """Получение информации о чате/пользователе по chat_id"""
-        url = f"{self.base_url}/getChat"
         payload = {"chat_id": chat_id}
 
         try:
-            response = requests.post(url, json=payload)
-            result = response.json()
+            result = self.outbound.call("getChat", payload)
 
             if result.get("ok"):
                 return result.get("result")
             else:
-                logger.error(f"Ошибка получения информации о чате: {result}")
+                logger.error("Ошибка получения информации о чате: %s", result)
                 return None
         except Exception as e:
-            logger.error(f"Ошибка запроса getChat: {e}")
+            logger.error("Ошибка запроса getChat: %s", e)
             return None
 
     def check_banwords(self, chat_id, text, message_id):
         """Проверка запрещенных слов"""
-        for key in banwords.keys():
-            if re.search(key, text, re.IGNORECASE):
-                self.send_message(
-                    chat_id, banwords.get(key, "нельзя"), reply_to_message_id=message_id
-                )
-                return True
+        with metrics.span("banwords"):
+            found = self.banwords.match(text)
+        if found:
+            note(banword=found[0])
+            self.send_message(
+                chat_id, found[1], reply_to_message_id=message_id, wait=False
+            )
+            return True
         return False
 
 
 # Инициализация бота
-bot = TelegramBot(BOT_TOKEN, LOGGER_CHAT_ID, "users.db")
+# Бот и все, что открывает файлы и базы, создается при первом обращении
+# или заранее в warm_up(), а не при импорте модуля
+_bot = None
+_update_dedup = None
+_init_lock = threading.Lock()
+
+
+def get_bot():
+    """Бот приложения, создается при первом вызове"""
+    global _bot
+    if _bot is None:
+        with _init_lock:
+            if _bot is None:
+                start = time.perf_counter()
+                _bot = TelegramBot(BOT_TOKEN, LOGGER_CHAT_ID, "users.db")
+                STARTUP["bot_init"] = round(time.perf_counter() - start, 4)
+                logger.info("Бот создан за %s с", STARTUP["bot_init"])
+    return _bot
+
+
+# Повторные доставки одного update_id не обрабатываем; с UPDATE_DEDUP_PERSIST=1
+# окно хранится в базе и общее для всех процессов
+def get_update_dedup():
+    global _update_dedup
+    if _update_dedup is None:
+        db = get_bot().db if os.getenv("UPDATE_DEDUP_PERSIST", "0") == "1" else None
+        with _init_lock:
+            if _update_dedup is None:
+                _update_dedup = UpdateDeduplicator(
+                    window=int(os.getenv("UPDATE_DEDUP_WINDOW", "10000")), db=db
+                )
+    return _update_dedup
+
+
+def warm_up():
+    """Создает бота, сессию Telegram и Faker до первого вебхука"""
+    start = time.perf_counter()
+    bot = get_bot()
+    get_update_dedup()
+    # Обращение к свойствам создает их заранее
+    bot.api.session
+    bot.faker
+    if WEBHOOK_MODE == "queue":
+        update_queue.start()
+    STARTUP["warm_up"] = round(time.perf_counter() - start, 4)
+    logger.info("Прогрев завершен за %s с", STARTUP["warm_up"])
+
+
+def warm_up_async():
+    """Прогрев в фоне: импорт приложения не ждет его окончания"""
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def handle_update(data):
+    """Обработка одного update от Telegram, в лог - одна запись на update"""
+    kind = next(
+        (key for key in ("message", "callback_query", "edited_message") if key in data), "other"
+    )
+    metrics.UPDATES.inc(kind)
+    with update_record(logger, update_id=data.get("update_id"), type=kind):
+        bot = get_bot()
+
+        # Обработка сообщения
+        if kind == "message":
+            bot.process_message(data["message"])
+        elif kind == "callback_query":
+            bot.process_callback(data["callback_query"])
+        elif kind == "other":
+            note(keys=list(data.keys()))
+
+
+update_queue = UpdateQueue(
+    handle_update, workers=WEBHOOK_WORKERS, maxsize=WEBHOOK_QUEUE_SIZE
+)
+
+
+def from_bot(fn):
+    """Значение для /tgbot/metrics из бота; пока бот не создан, метрики нет"""
+    return lambda: None if _bot is None else fn(_bot)
+
+
+def cache_stat(key):
+    """Поле stats() кешей бота по имени кеша"""
+    return from_bot(
+        lambda bot: {"chat_info": bot.chat_info.stats()[key], "pages": bot.page_cache.stats()[key]}
+    )
+
+
+metrics.REGISTRY.collect(
+    "tgbot_update_queue_depth", "Update в очереди обработчиков", update_queue.depth
+)
+metrics.REGISTRY.collect(
+    "tgbot_outbound_queued",
+    "Исходящие вызовы в очереди планировщика",
+    from_bot(lambda bot: bot.outbound.stats()["queued"]),
+)
+metrics.REGISTRY.collect(
+    "tgbot_outbound_flood_waits_total",
+    "Ответы 429 от Telegram",
+    from_bot(lambda bot: bot.outbound.stats()["flood_waits"]),
+    kind="counter",
+)
+metrics.REGISTRY.collect(
+    "tgbot_album_pending",
+    "Альбомы, ждущие остальных частей",
+    from_bot(lambda bot: bot.media_groups.pending()),
+)
+metrics.REGISTRY.collect(
+    "tgbot_db_pending", "Пачки записей в очереди базы", from_bot(lambda bot: bot.db.stats()["pending"])
+)
+metrics.REGISTRY.collect(
+    "tgbot_dedup_window",
+    "update_id в окне дедупликации",
+    lambda: None if _update_dedup is None else _update_dedup.stats()["window"],
+)
+metrics.REGISTRY.collect(
+    "tgbot_dedup_hits_total",
+    "Повторные доставки update",
+    lambda: None if _update_dedup is None else _update_dedup.stats()["hits"],
+    kind="counter",
+)
+metrics.REGISTRY.collect(
+    "tgbot_cache_entries",
+    "Записей в кешах",
+    cache_stat("size"),
+    labelname="cache",
+)
+metrics.REGISTRY.collect(
+    "tgbot_cache_hits_total",
+    "Попадания в кеши",
+    cache_stat("hits"),
+    kind="counter",
+    labelname="cache",
+)
+metrics.REGISTRY.collect(
+    "tgbot_cache_misses_total",
+    "Промахи кешей",
+    cache_stat("misses"),
+    kind="counter",
+    labelname="cache",
+)
 
 
 @app.route("/tgbot/webhook", methods=["POST"])
 def webhook():
     """Обработчик вебхука от Telegram"""
-    logger.info("=== ПОЛУЧЕН ВЕБХУК ОТ TELEGRAM ===")
+    with metrics.span("webhook"):
+        status, response = handle_webhook()
+    metrics.WEBHOOK_RESPONSES.inc(status)
+    return response
+
 
+def handle_webhook():
+    """Проверка и обработка запроса вебхука, возвращает (статус, ответ)"""
     # Проверка секретного токена
     secret_token = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
     if secret_token != SECRET_TOKEN:
-        logger.warning(f"Неавторизованный запрос. Токен: {secret_token}")
-        return "Unauthorized", 401
+        logger.warning("Неавторизованный запрос. Токен: %s", secret_token)
+        return "unauthorized", ("Unauthorized", 401)
 
     try:
         data = request.get_json()
-        logger.info(f"Тип update: {list(data.keys())}")
+        update_id = data.get("update_id")
 
-        # Обработка сообщения
-        if "message" in data:
-            bot.process_message(data["message"])
-        elif "edited_message" in data:
-            logger.info("Получено редактированное сообщение")
-        else:
-            logger.info(f"Получен update другого типа: {list(data.keys())}")
+        if not get_update_dedup().claim(update_id):
+            logger.info("Повторная доставка update %s, пропускаем", update_id)
+            return "duplicate", jsonify({"status": "duplicate"})
+
+        if WEBHOOK_MODE == "queue":
+            # Сразу отвечаем Telegram, обработка идет в фоне
+            if not update_queue.submit(data):
+                # Не приняли: ответ не 2xx, чтобы Telegram доставил update повторно
+                get_update_dedup().release(update_id)
+                return "dropped", (jsonify({"status": "dropped"}), 503)
+            return "queued", jsonify({"status": "queued"})
 
-        return jsonify({"status": "ok"})
+        # Последний вызов без ожидания результата отдаем в теле ответа
+        try:
+            with get_bot().outbound.capture_reply() as capture:
+                handle_update(data)
+        except Exception:
+            get_update_dedup().release(update_id)
+            raise
+        if capture["reply"]:
+            return "inline_reply", jsonify(capture["reply"])
+        return "ok", jsonify({"status": "ok"})
 
     except Exception as e:
-        logger.error(f"Ошибка обработки вебхука: {e}", exc_info=True)
-        return jsonify({"status": "error"}), 500
+        logger.error("Ошибка обработки вебхука: %s", e, exc_info=True)
+        return "error", (jsonify({"status": "error"}), 500)
 
 
 @app.route("/tgbot/setup", methods=["GET"])
 def setup_webhook():
     """Установка вебхука"""
     webhook_url = f"{BASE_URL}/webhook"
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
     payload = {
         "url": webhook_url,
         "secret_token": SECRET_TOKEN,
         "drop_pending_updates": True,
-        "allowed_updates": ["message", "edited_message"],
+        "allowed_updates": ["message", "edited_message", "callback_query"],
     }
 
-    logger.info(f"Устанавливаем вебхук: {webhook_url}")
-    response = requests.post(url, json=payload)
-    result = response.json()
-    logger.info(f"Результат: {result}")
+    logger.info("Устанавливаем вебхук: %s", webhook_url)
+    result = get_bot().outbound.call("setWebhook", payload)
+    logger.info("Результат: %s", result)
 
     return jsonify(result)
 
@@ -885,12 +1278,9 @@ def setup_webhook():
 @app.route("/tgbot/remove", methods=["GET"])
 def remove_webhook():
     """Удаление вебхука"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/deleteWebhook"
-
     logger.info("Удаляем вебхук")
-    response = requests.post(url)
-    result = response.json()
-    logger.info(f"Результат: {result}")
+    result = get_bot().outbound.call("deleteWebhook")
+    logger.info("Результат: %s", result)
 
     return jsonify(result)
 
@@ -898,15 +1288,43 @@ def remove_webhook():
 @app.route("/tgbot/status", methods=["GET"])
 def webhook_status():
     """Проверка статуса вебхука"""
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/getWebhookInfo"
-
-    response = requests.get(url)
-    result = response.json()
-    logger.info(f"Статус вебхука: {result}")
+    result = get_bot().outbound.call("getWebhookInfo")
+    logger.info("Статус вебхука: %s", result)
 
     return jsonify(result)
 
 
+@app.route("/tgbot/metrics", methods=["GET"])
+def metrics_export():
+    """Метрики в формате Prometheus"""
+    return Response(
+        metrics.REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.route("/tgbot/queue", methods=["GET"])
+def queue_status():
+    """Состояние очереди обновлений"""
+    return jsonify({"mode": WEBHOOK_MODE, **update_queue.stats()})
+
+
+@app.route("/tgbot/stats", methods=["GET"])
+def bot_stats():
+    """Статистика клиента Telegram и кешей"""
+    bot = get_bot()
+    return jsonify(
+        {
+            "startup": STARTUP,
+            "api": bot.api.stats(),
+            "outbound": bot.outbound.stats(),
+            "chat_info": bot.chat_info.stats(),
+            "db": bot.db.stats(),
+            "logger_digest": bot.logger_digest.stats() if bot.logger_digest else None,
+            "dedup": get_update_dedup().stats(),
+        }
+    )
+
+
 @app.route("/tgbot/test", methods=["GET"])
 def test():
     """Тестовый маршрут"""
@@ -940,6 +1358,8 @@ def index():
 # WSGI application
 application = app
 
+STARTUP["app_import"] = round(time.perf_counter() - _import_started, 4)
+
 if __name__ == "__main__":
     logger.info("Запуск Flask приложения")
     app.run(host="0.0.0.0", port=8000)
@@ -0,0 +1,153 @@
+"""Поиск запрещенных слов за один проход по тексту"""
+import re
+from collections import deque
+
+try:
+    import re._constants as sre_constants
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# Спецсимволы регулярных выражений: ключ без них - обычная строка
+_REGEX_CHARS = re.compile(r"[\\.^$*+?{}\[\]|()]")
+# Обратные ссылки ломают нумерацию групп в общем выражении
+_BACKREF = re.compile(r"\\[1-9]|\(\?P=")
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик для набора строк"""
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]  # индексы всех слов, заканчивающихся в узле
+        for index, word in enumerate(words):
+            node = 0
+            for char in word:
+                nxt = self.goto[node].get(char)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][char] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                node = nxt
+            self.out[node] += (index,)
+        self._build()
+
+    def _build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                if node:
+                    fail = self.fail[node]
+                    while fail and char not in self.goto[fail]:
+                        fail = self.fail[fail]
+                    self.fail[child] = self.goto[fail].get(char, 0)
+                # Слова, оканчивающиеся на суффиксе узла, тоже найдены в этой позиции
+                self.out[child] += self.out[self.fail[child]]
+
+    def search(self, text):
+        """Возвращает множество индексов слов, встречающихся в тексте"""
+        goto, fail, out = self.goto, self.fail, self.out
+        node = 0
+        found = set()
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+
+def required_literal(pattern, flags=0):
+    """Самая длинная строка, которая обязательно входит в любое совпадение"""
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except re.error:
+        return ""
+    best = current = ""
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            current += chr(av)
+            best = max(best, current, key=len)
+        else:
+            current = ""
+    return best
+
+
+class BanwordMatcher:
+    """Скомпилированная таблица запрещенных слов.
+
+    Для каждого ключа берется обязательная подстрока (для обычных слов -
+    само слово), и все подстроки ищутся за один проход автоматом
+    Ахо-Корасик. Регулярные выражения проверяются только для ключей,
+    чья подстрока нашлась в тексте. Ключи без такой подстроки объединены
+    в одно выражение с именованными группами. Возвращается самое левое
+    совпадение в тексте, при равенстве - ключ, идущий раньше в таблице.
+    """
+
+    def __init__(self, banwords, flags=re.IGNORECASE, min_literal=2):
+        self.banwords = dict(banwords)
+        self.keys = list(self.banwords)
+        self.flags = flags
+        self.patterns = [re.compile(key, flags) for key in self.keys]
+
+        words = {}  # подстрока -> индексы ключей
+        rest = []
+        for index, key in enumerate(self.keys):
+            if _REGEX_CHARS.search(key):
+                literal = required_literal(key, flags)
+                if len(literal) < min_literal:
+                    rest.append(index)
+                    continue
+            else:
+                literal = key
+            words.setdefault(literal.lower(), []).append(index)
+
+        self.word_keys = list(words.values())
+        self.automaton = AhoCorasick(list(words)) if words else None
+
+        self.combined = None
+        single = [i for i in rest if _BACKREF.search(self.keys[i])]
+        grouped = [i for i in rest if i not in single]
+        if grouped:
+            try:
+                self.combined = re.compile(
+                    "|".join(f"(?P<b{i}>{self.keys[i]})" for i in grouped), flags
+                )
+            except re.error:
+                # Ключи несовместимы в одном выражении (например, свои именованные группы)
+                single.extend(grouped)
+        self.single = sorted(single)
+
+    def match(self, text):
+        """Возвращает (ключ, ответ) первого совпадения или None"""
+        if not text:
+            return None
+        candidates = []
+        if self.automaton is not None:
+            for word in self.automaton.search(text.lower()):
+                for index in self.word_keys[word]:
+                    found = self.patterns[index].search(text)
+                    if found:
+                        candidates.append((found.start(), index))
+        if self.combined is not None:
+            found = self.combined.search(text)
+            if found:
+                candidates.append((found.start(), int(found.lastgroup[1:])))
+        for index in self.single:
+            found = self.patterns[index].search(text)
+            if found:
+                candidates.append((found.start(), index))
+        if not candidates:
+            return None
+        key = self.keys[min(candidates)[1]]
+        return key, self.banwords.get(key, "нельзя")
+
+    def __len__(self):
+        return len(self.keys)
@@ -0,0 +1,86 @@
+"""Сравнение поиска запрещенных слов: старый цикл по ключам и BanwordMatcher
+
+Запуск: python benchmarks/banwords_bench.py [--sizes 10,100,1000,10000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from banword_matcher import BanwordMatcher  # noqa: E402
+
+ALPHABET = "абвгдежзийклмнопрстуфхцчшщыэюя"
+
+
+def make_banwords(size, regex_share, rng):
+    """Синтетическая таблица: часть ключей строки, часть регулярные выражения"""
+    banwords = {}
+    while len(banwords) < size:
+        word = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(5, 10)))
+        if rng.random() < regex_share:
+            word = rf"\b{word[:-2]}\w*"
+        banwords[word] = f"нельзя {len(banwords)}"
+    return banwords
+
+
+def make_texts(count, rng):
+    texts = []
+    for _ in range(count):
+        words = [
+            "".join(rng.choice(ALPHABET) for _ in range(rng.randint(2, 9)))
+            for _ in range(rng.randint(5, 40))
+        ]
+        texts.append(" ".join(words))
+    return texts
+
+
+def naive(banwords, text):
+    """Старая реализация check_banwords"""
+    for key in banwords.keys():
+        if re.search(key, text, re.IGNORECASE):
+            return key, banwords.get(key, "нельзя")
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--regex-share", type=float, default=0.3)
+    parser.add_argument("--texts", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = make_texts(args.texts, rng)
+    print(f"{'ключей':>8} {'сборка, мс':>12} {'цикл, мкс':>12} {'matcher, мкс':>14} {'ускорение':>10}")
+    for size in map(int, args.sizes.split(",")):
+        banwords = make_banwords(size, args.regex_share, rng)
+        start = timeit.default_timer()
+        matcher = BanwordMatcher(banwords)
+        build_ms = (timeit.default_timer() - start) * 1000
+
+        # Старый цикл берет первый ключ по порядку таблицы, matcher - самый левый
+        # в тексте, поэтому сверяем только сам факт срабатывания
+        for text in texts:
+            assert (matcher.match(text) is None) == (naive(banwords, text) is None), text
+
+        # Старый цикл на больших таблицах очень медленный, поэтому повторов меньше
+        number = max(1, 20000 // (size * len(texts) // 10 + 1))
+        naive_time = timeit.timeit(
+            lambda: [naive(banwords, t) for t in texts], number=number
+        ) / (number * len(texts))
+        matcher_time = timeit.timeit(
+            lambda: [matcher.match(t) for t in texts], number=number * 10
+        ) / (number * 10 * len(texts))
+        print(
+            f"{size:>8} {build_ms:>12.1f} {naive_time * 1e6:>12.1f} "
+            f"{matcher_time * 1e6:>14.1f} {naive_time / matcher_time:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Генератор синтетических update в пропорциях реального трафика бота
+
+Виды событий (доли задаются --mix):
+  group_text      - обычный текст в группе без запрещенных слов
+  group_banword   - текст в группе с запрещенным словом
+  forward         - одиночный пост канала, пересланный в группу
+  album_caption   - альбом из канала, подпись у одной из частей
+  album_plain     - альбом без подписи
+  private         - личное сообщение боту (текст или /start)
+  admin           - команда администратора в личке
+
+Альбом - одно событие из нескольких update с общим media_group_id.
+Один и тот же --seed дает один и тот же поток.
+
+Запуск: python benchmarks/gen_updates.py --count 1000 [--out updates.jsonl]
+        python benchmarks/gen_updates.py --count 1000 --replay -- --no-limits --rate 100
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from banword_matcher import required_literal  # noqa: E402
+
+DEFAULT_MIX = {
+    "group_text": 45,
+    "group_banword": 5,
+    "forward": 15,
+    "album_caption": 5,
+    "album_plain": 5,
+    "private": 20,
+    "admin": 5,
+}
+
+WORDS = (
+    "привет как дела завтра пара кто идет лекция конспект сессия зачет экзамен "
+    "преподаватель аудитория расписание столовая общежитие библиотека практика "
+    "лабораторная семинар староста перенесли отменили спасибо понял ок"
+).split()
+
+ADMIN_COMMANDS = (
+    "/help",
+    "/comment_list",
+    "/comment_list photo",
+    "/comment_list text 2",
+    "/get_users_list",
+    "/check_permissions",
+)
+
+
+def banword_samples():
+    """Слова, на которые срабатывает таблица запрещенных слов.
+
+    Берется banwords.py, если он есть, иначе таблица из replay.py. Для
+    каждого ключа пробуем обязательную подстроку шаблона и оставляем те,
+    что действительно совпадают.
+    """
+    try:
+        from banwords import banwords
+    except ImportError:
+        from replay import SAMPLE_BANWORDS as banwords
+    samples = []
+    for pattern in banwords:
+        literal = required_literal(pattern, re.IGNORECASE)
+        for candidate in (pattern, literal, literal + "ы"):
+            if candidate and re.search(pattern, candidate, re.IGNORECASE):
+                samples.append(candidate)
+                break
+    return samples or ["курсач"]
+
+
+def parse_mix(text):
+    """Доли из строки вида group_text=40,forward=20; остальные виды - по умолчанию"""
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        name, _, share = part.partition("=")
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"Неизвестный вид события: {name}")
+        mix[name] = float(share)
+    return mix
+
+
+class UpdateGenerator:
+    """Поток update: группы, каналы и пользователи выбираются из фиксированных пулов"""
+
+    def __init__(self, seed=1, mix=None, groups=20, users=200, admins=3, album_size=(2, 6)):
+        self.rng = random.Random(seed)
+        self.mix = mix or dict(DEFAULT_MIX)
+        self.groups = [-1001000000000 - num for num in range(groups)]
+        self.channels = [-1002000000000 - num for num in range(groups)]
+        self.users = [100000 + num for num in range(users)]
+        self.admins = self.users[:admins]
+        self.album_size = album_size
+        self.banwords = banword_samples()
+        self.update_id = self.rng.randint(1, 10**6)
+        self.message_ids = {}  # chat_id -> последний message_id
+        self.media_group_id = 10**12 + self.rng.randint(0, 10**6)
+        # Фиксированное начало, чтобы поток зависел только от seed
+        self.now = 1700000000
+
+    def _message(self, chat, sender, **fields):
+        chat_id = chat["id"]
+        self.message_ids[chat_id] = self.message_ids.get(chat_id, 0) + 1
+        self.now += self.rng.randint(0, 2)
+        message = {
+            "message_id": self.message_ids[chat_id],
+            "date": self.now,
+            "chat": chat,
+            "from": sender,
+        }
+        message.update(fields)
+        self.update_id += 1
+        return {"update_id": self.update_id, "message": message}
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "Тест", "username": f"user{user_id}"}
+
+    def _group(self):
+        chat_id = self.rng.choice(self.groups)
+        return {"id": chat_id, "type": "supergroup", "title": f"Группа {-chat_id % 1000}"}
+
+    def _private(self, user_id):
+        return {"id": user_id, "type": "private", "username": f"user{user_id}", "first_name": "Тест"}
+
+    def _text(self, low=3, high=15):
+        return " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high)))
+
+    def _forward_fields(self, group):
+        """Поля автоматической пересылки поста из привязанного канала"""
+        channel_id = self.channels[self.groups.index(group["id"])]
+        channel = {"id": channel_id, "type": "channel", "title": f"Канал {-channel_id % 1000}"}
+        return {
+            "sender_chat": channel,
+            "is_automatic_forward": True,
+            "forward_origin": {
+                "type": "channel",
+                "chat": channel,
+                "message_id": self.rng.randint(1, 10**5),
+                "date": self.now,
+            },
+        }
+
+    def _photo(self):
+        file_id = f"AgAC{self.rng.getrandbits(64):x}"
+        return [
+            {"file_id": file_id, "file_unique_id": file_id[:12], "width": 90, "height": 90},
+            {"file_id": file_id + "x", "file_unique_id": file_id[:12] + "x", "width": 1280, "height": 1280},
+        ]
+
+    def group_text(self):
+        yield self._message(self._group(), self._user(self.rng.choice(self.users)), text=self._text())
+
+    def group_banword(self):
+        words = self._text(2, 10).split()
+        words.insert(self.rng.randint(0, len(words)), self.rng.choice(self.banwords))
+        yield self._message(self._group(), self._user(self.rng.choice(self.users)), text=" ".join(words))
+
+    def forward(self):
+        group = self._group()
+        sender = {"id": 777000, "is_bot": False, "first_name": "Telegram"}
+        if self.rng.random() < 0.5:
+            yield self._message(group, sender, text=self._text(10, 60), **self._forward_fields(group))
+        else:
+            yield self._message(
+                group, sender, photo=self._photo(), caption=self._text(5, 30),
+                **self._forward_fields(group),
+            )
+
+    def _album(self, captioned):
+        group = self._group()
+        sender = {"id": 777000, "is_bot": False, "first_name": "Telegram"}
+        self.media_group_id += 1
+        size = self.rng.randint(*self.album_size)
+        caption_at = self.rng.randrange(size) if captioned else None
+        forward = self._forward_fields(group)
+        for num in range(size):
+            fields = {"media_group_id": str(self.media_group_id), "photo": self._photo(), **forward}
+            if num == caption_at:
+                fields["caption"] = self._text(5, 30)
+            yield self._message(group, sender, **fields)
+
+    def album_caption(self):
+        return self._album(True)
+
+    def album_plain(self):
+        return self._album(False)
+
+    def private(self):
+        user_id = self.rng.choice(self.users)
+        text = "/start" if self.rng.random() < 0.1 else self._text(1, 12)
+        yield self._message(self._private(user_id), self._user(user_id), text=text)
+
+    def admin(self):
+        user_id = self.rng.choice(self.admins)
+        yield self._message(
+            self._private(user_id), self._user(user_id), text=self.rng.choice(ADMIN_COMMANDS)
+        )
+
+    def events(self, count):
+        """count событий (альбом - одно событие из нескольких update)"""
+        kinds = [kind for kind, share in self.mix.items() if share > 0]
+        weights = [self.mix[kind] for kind in kinds]
+        for _ in range(count):
+            kind = self.rng.choices(kinds, weights)[0]
+            yield from getattr(self, kind)()
+
+
+def main():
+    argv = sys.argv[1:]
+    replay_argv = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, replay_argv = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000, help="количество событий")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mix", default="", help='доли видов, например "group_text=40,forward=20"')
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--out", default="updates.jsonl", help='JSONL-файл, "-" - stdout')
+    parser.add_argument("--replay", action="store_true", help="сразу отправить в replay.py (аргументы после --)")
+    args = parser.parse_args(argv)
+
+    generator = UpdateGenerator(
+        seed=args.seed, mix=parse_mix(args.mix), groups=args.groups, users=args.users
+    )
+    updates = generator.events(args.count)
+    if args.replay:
+        import replay
+
+        replay.main(replay_argv, updates=updates)
+        return
+
+    f = sys.stdout if args.out == "-" else open(args.out, "w", encoding="utf-8")
+    try:
+        written = 0
+        for update in updates:
+            f.write(json.dumps(update, ensure_ascii=False) + "\n")
+            written += 1
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    if f is not sys.stdout:
+        print(f"Записано update: {written} ({args.count} событий) в {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Микробенчмарки функций, через которые проходит каждый update
+
+Бот собирается во временной папке, исходящие вызовы заменены заглушкой,
+поэтому сеть не нужна. Результаты (мкс на вызов, лучший из повторов)
+сохраняются в JSON; при сравнении с базовым файлом замедление больше
+порога считается регрессией, и скрипт завершается с кодом 1.
+
+Запуск: python benchmarks/hot_paths.py [--save hot_paths.json]
+        python benchmarks/hot_paths.py --compare hot_paths.json [--threshold 0.2]
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import timeit
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from comment_templates import FakerPool  # noqa: E402
+from gen_updates import WORDS, banword_samples  # noqa: E402
+from replay import import_app  # noqa: E402
+
+LOGGED_MSGS_SIZES = (1000, 10000, 100000)
+
+
+class StubOutbound:
+    """Заглушка планировщика: вызовы Bot API сразу "успешны" """
+
+    def __init__(self):
+        self.message_ids = itertools.count(1)
+
+    def call(self, method, payload=None, chat_id=None, priority=0):
+        return {"ok": True, "result": {"message_id": next(self.message_ids)}}
+
+    def submit(self, method, payload=None, chat_id=None, priority=0):
+        future = Future()
+        future.set_result(self.call(method, payload, chat_id, priority))
+        return future
+
+    def defer(self, method, payload=None, chat_id=None, priority=0):
+        pass
+
+    def send(self, method, payload=None, chat_id=None, priority=0):
+        pass
+
+    def stats(self):
+        return {}
+
+
+class BenchPool(FakerPool):
+    """Пул подстановок, который никогда не пустеет.
+
+    В бою буферы пополняет фоновый поток, и take() почти не промахивается.
+    Цикл timeit выбирает значения быстрее, поэтому здесь пополнение
+    синхронное, а значения - заранее сгенерированные Faker и идут по кругу.
+    Так замеряется путь через буфер, а не генерация Faker на месте.
+    """
+
+    def __init__(self, pool, samples=256):
+        generators = {}
+        for name, generate in pool.generators.items():
+            generators[name] = itertools.cycle([generate() for _ in range(samples)]).__next__
+        super().__init__(generators, pool.size, pool.low_water)
+        self.fill()
+
+    def refill(self):
+        self.fill()
+
+
+def measure(fn, repeat=5):
+    """Время одного вызова fn в микросекундах (лучший из repeat замеров)"""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def build_bot(workdir, rng):
+    app = import_app(workdir)
+    bot = app.get_bot()
+    bot.outbound = StubOutbound()
+    bot.faker_pool = BenchPool(bot.faker_pool)
+    for num in range(50):
+        bot.comments.add("text", f"Комментарий {num}: " + "{{name}} из {{company}}")
+        bot.comments.add("photo", f"Фото {num}")
+    for num in range(500):
+        bot.add_user(100000 + num, f"user{num}")
+    # Администратор, от имени которого вызываются команды
+    bot.db.write("UPDATE users SET permission = 3 WHERE chat_id = ?", (100000,))
+    bot.permissions.set(100000, 3)
+    return app, bot
+
+
+def bench_bot(bot, rng):
+    """Функции бота на пути обработки update"""
+    results = {}
+    hits = banword_samples()
+    hit_texts = [f"{' '.join(rng.sample(WORDS, 8))} {rng.choice(hits)}" for _ in range(100)]
+    miss_texts = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))) for _ in range(100)]
+    texts = itertools.cycle(hit_texts)
+    results["check_banwords_hit"] = measure(lambda: bot.check_banwords(-1, next(texts), 1))
+    texts = itertools.cycle(miss_texts)
+    results["check_banwords_miss"] = measure(lambda: bot.check_banwords(-1, next(texts), 1))
+
+    template = next(comment for _, comment in bot.comments.list("text") if comment.placeholders)
+    results["parse_comment"] = measure(lambda: bot.parse_comment(template))
+
+    chats = itertools.cycle(range(-1000, -900))
+    results["comment_pick"] = measure(lambda: bot.comments.pick(next(chats), "text"))
+
+    results["comment_list_cached"] = measure(lambda: bot.handle_list_comment(100000, "text", 1))
+
+    def render_uncached():
+        bot.page_cache.invalidate("comments")
+        bot.handle_list_comment(100000, "text", 1)
+
+    results["comment_list_render"] = measure(render_uncached)
+
+    def render_users():
+        bot.page_cache.invalidate("users")
+        bot.handle_get_users_list(100000)
+
+    results["users_list_render"] = measure(render_users)
+    results["required_permission"] = measure(lambda: bot.handle_help(100000))
+    # Промах значит, что замерялась генерация Faker, а не буфер
+    assert bot.faker_pool.misses == 0, f"промахов пула подстановок: {bot.faker_pool.misses}"
+    return results
+
+
+def bench_logged_msgs(workdir, sizes):
+    """Добавление записи в logged_msgs при разном размере хранилища"""
+    from logged_msgs_store import LoggedMsgsStore
+    from state_backend import SQLiteState, StateMapping
+
+    results = {}
+    for size in sizes:
+        entries = {
+            str(num): {"chat_id": num, "message_id": num, "timestamp": 1700000000.0 + num}
+            for num in range(size)
+        }
+        with open(os.path.join(workdir, f"logged_{size}.json"), "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        store = LoggedMsgsStore(os.path.join(workdir, f"logged_{size}.json"), compact_every=10**9)
+        keys = itertools.count(size)
+        results[f"logged_msgs_journal_{size}"] = measure(
+            lambda: store.__setitem__(
+                str(next(keys)), {"chat_id": 1, "message_id": 1, "timestamp": 1800000000.0}
+            )
+        )
+        store.close()
+
+        state = SQLiteState(os.path.join(workdir, f"state_{size}.db"))
+        state.set_many("logged_msgs", entries, ttl=86400)
+        mapping = StateMapping(state, "logged_msgs", 86400)
+        keys = itertools.count(size)
+        results[f"logged_msgs_sqlite_{size}"] = measure(
+            lambda: mapping.__setitem__(
+                str(next(keys)), {"chat_id": 1, "message_id": 1, "timestamp": 1800000000.0}
+            )
+        )
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Печатает сравнение с базовыми замерами, возвращает список регрессий"""
+    regressions = []
+    print(f"{'замер':<30} {'база, мкс':>11} {'сейчас, мкс':>12} {'изменение':>10}")
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<30} {'-':>11} {value:>12.2f} {'новый':>10}")
+            continue
+        change = value / base - 1
+        mark = "  РЕГРЕССИЯ" if change > threshold else ""
+        print(f"{name:<30} {base:>11.2f} {value:>12.2f} {change:>+9.0%}{mark}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save", default=None, help="записать результаты в JSON")
+    parser.add_argument("--compare", default=None, help="сравнить с JSON базовых замеров")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление (0.2 = 20%%)")
+    parser.add_argument("--sizes", default=",".join(map(str, LOGGED_MSGS_SIZES)), help="размеры logged_msgs")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    # Пути из аргументов считаем до перехода во временную папку
+    save = os.path.abspath(args.save) if args.save else None
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    logging.disable(logging.CRITICAL)
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="tgbot-hot-")
+
+    _, bot = build_bot(workdir, rng)
+    results = bench_bot(bot, rng)
+    results.update(bench_logged_msgs(workdir, [int(size) for size in args.sizes.split(",")]))
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+    else:
+        regressions = []
+        for name, value in results.items():
+            print(f"{name:<30} {value:>12.2f} мкс")
+
+    if save:
+        with open(save, "w", encoding="utf-8") as f:
+            json.dump(
+                {"python": sys.version.split()[0], "results": results},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        print(f"Результаты записаны в {save}")
+
+    if regressions:
+        print(f"Медленнее базы больше чем на {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Прогон update через /tgbot/webhook с замером задержек и пропускной способности
+
+По умолчанию приложение импортируется в этот же процесс и работает с
+поддельным Bot API (fake_telegram.py) во временной папке, поэтому сеть
+и рабочие базы не нужны. С --url запросы идут в уже запущенное
+приложение, счетчики исходящих вызовов берутся из --fake-url.
+
+Запуск: python benchmarks/replay.py updates.jsonl [--rate 50] [--concurrency 8] [--latency 30]
+"""
+import argparse
+import collections
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram, serve  # noqa: E402
+
+SECRET = os.getenv("WEBHOOK_SECRET", "default_secret")
+
+# Таблица запрещенных слов, если banwords.py в репозитории нет (он не хранится в git)
+SAMPLE_BANWORDS = {
+    r"\bкурсач\w*": "Курсовые здесь не обсуждаем",
+    r"дипл[оа]м": "Дипломы тоже",
+    "реферат": "И рефераты",
+    r"\bспам\w*": "Без спама",
+}
+
+# Комментарии для пустой временной базы, чтобы пересланные посты получали ответ
+SEED_COMMENTS = {
+    "text": ["Интересно", "Спасибо, {{name}}!", "Звоните: {{phone_number}}"],
+    "photo": ["Красивое фото", "Где это, {{address}}?"],
+}
+
+
+def read_updates(path):
+    """Update из JSONL-файла (или stdin для "-"), по одному"""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу (values отсортированы)"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(share * len(values))) - 1))]
+
+
+def import_app(workdir, api_url=None, no_limits=False):
+    """Импортирует app.py так, чтобы базы и журналы бота создавались в workdir"""
+    if api_url:
+        os.environ["TELEGRAM_API_URL"] = api_url
+    os.environ.setdefault("BOT_TOKEN", "bench")
+    os.environ.setdefault("LOGGER_CHAT_ID", "-1")
+    os.environ.setdefault("IGNORING_CHAT_IDS", "0")
+    if no_limits:
+        # Замеряем сам бот, а не лимиты Telegram в планировщике
+        os.environ["OUTBOUND_GLOBAL_RATE"] = "100000"
+        os.environ["OUTBOUND_GROUP_PER_MINUTE"] = "6000000"
+        os.environ["OUTBOUND_PRIVATE_RATE"] = "100000"
+    # Базы и журналы бота создаются в текущей папке
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    if importlib.util.find_spec("banwords") is None:
+        with open(os.path.join(workdir, "banwords.py"), "w", encoding="utf-8") as f:
+            f.write(f"banwords = {SAMPLE_BANWORDS!r}\n")
+        sys.path.insert(0, workdir)
+    import app
+
+    return app
+
+
+def seed_comments(bot):
+    for kind, texts in SEED_COMMENTS.items():
+        if not bot.comments.list(kind):
+            for text in texts:
+                bot.comments.add(kind, text)
+
+
+class InProcessTarget:
+    """Приложение в этом же процессе, Bot API - поддельный сервер"""
+
+    def __init__(self, fake, workdir, no_limits=False):
+        server = serve(fake)
+        host, port = server.server_address
+        app = import_app(workdir, f"http://{host}:{port}", no_limits)
+        self.app = app
+        self.fake = fake
+        app.warm_up()
+        seed_comments(app.get_bot())
+        self.local = threading.local()
+
+    def post(self, update):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.app.test_client()
+        response = client.post(
+            "/tgbot/webhook",
+            json=update,
+            headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+        )
+        return response.status_code, response.get_json(silent=True) or {}
+
+    def drain(self, timeout):
+        """Ждет, пока очередь обновлений и исходящие запросы опустеют"""
+        deadline = time.monotonic() + timeout
+        bot = self.app.get_bot()
+        while time.monotonic() < deadline:
+            if (
+                self.app.update_queue.depth() == 0
+                and bot.outbound.stats()["queued"] == 0
+                and bot.media_groups.pending() == 0
+            ):
+                break
+            time.sleep(0.05)
+
+    def outbound(self):
+        return {**self.fake.stats(), "scheduler": self.app.get_bot().outbound.stats()}
+
+
+class HttpTarget:
+    """Уже запущенное приложение по адресу url"""
+
+    def __init__(self, url, fake_url=None):
+        import requests
+
+        self.requests = requests
+        self.url = url
+        self.fake_url = fake_url
+        self.local = threading.local()
+
+    def post(self, update):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.post(
+            self.url,
+            json=update,
+            headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+            timeout=60,
+        )
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+    def drain(self, timeout):
+        time.sleep(timeout)
+
+    def outbound(self):
+        if not self.fake_url:
+            return None
+        return self.requests.get(f"{self.fake_url}/stats", timeout=10).json()
+
+
+def replay(target, updates, rate=0.0, concurrency=8):
+    """Отправляет update с заданной частотой (0 - без ограничения), возвращает отчет"""
+    latencies = []
+    statuses = collections.Counter()
+    inline_replies = collections.Counter()
+    lock = threading.Lock()
+
+    def send(update):
+        start = time.perf_counter()
+        try:
+            status, body = target.post(update)
+        except Exception as e:
+            status, body = f"error: {type(e).__name__}", {}
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[body.get("status") or body.get("method") or str(status)] += 1
+            if "method" in body:
+                inline_replies[body["method"]] += 1
+
+    started = time.perf_counter()
+    count = 0
+    # Не держим в памяти больше нескольких пачек запросов вперед
+    slots = threading.BoundedSemaphore(concurrency * 4)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for update in updates:
+            if rate:
+                delay = started + count / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            slots.acquire()
+            executor.submit(send, update).add_done_callback(lambda _: slots.release())
+            count += 1
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "updates": count,
+        "seconds": round(elapsed, 3),
+        "throughput": round(count / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        },
+        "responses": dict(statuses),
+        "inline_replies": dict(inline_replies),
+    }
+
+
+def print_report(report):
+    latency = report["latency_ms"]
+    print(f"update: {report['updates']} за {report['seconds']} с ({report['throughput']}/с)")
+    print(
+        f"задержка, мс: p50 {latency['p50']}  p95 {latency['p95']}  "
+        f"p99 {latency['p99']}  max {latency['max']}"
+    )
+    print(f"ответы вебхука: {report['responses']}")
+    if report["inline_replies"]:
+        print(f"вызовы в ответе вебхука: {report['inline_replies']}")
+    outbound = report.get("outbound")
+    if outbound:
+        print(f"исходящие вызовы: {outbound['calls']} (429: {outbound['errors_429']})")
+        if "scheduler" in outbound:
+            scheduler = outbound["scheduler"]
+            print(
+                f"планировщик: flood_waits {scheduler['flood_waits']}, "
+                f"в очереди {scheduler['queued']}"
+            )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("updates", nargs="?", default="updates.jsonl", help='JSONL с update, "-" - stdin')
+    parser.add_argument("--rate", type=float, default=0.0, help="update в секунду, 0 - без ограничения")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=30.0, help="задержка поддельного API, мс")
+    parser.add_argument("--jitter", type=float, default=10.0, help="разброс задержки, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--drain", type=float, default=30.0, help="сколько ждать фоновые отправки, с")
+    parser.add_argument("--no-limits", action="store_true", help="снять лимиты планировщика исходящих")
+    parser.add_argument("--workdir", default=None, help="папка для баз бота (по умолчанию временная)")
+    parser.add_argument("--url", default=None, help="адрес вебхука запущенного приложения")
+    parser.add_argument("--fake-url", default=None, help="адрес fake_telegram.py для счетчиков")
+    parser.add_argument("--json", action="store_true", help="вывести отчет в JSON")
+    return parser
+
+
+def main(argv=None, updates=None):
+    """updates - итератор update вместо файла (см. gen_updates.py)"""
+    args = build_parser().parse_args(argv)
+    if updates is None:
+        # Путь считаем до перехода во временную папку
+        path = args.updates if args.updates == "-" else os.path.abspath(args.updates)
+        updates = read_updates(path)
+    if args.url:
+        target = HttpTarget(args.url, args.fake_url)
+    else:
+        fake = FakeTelegram(args.latency / 1000, args.jitter / 1000, args.error_rate, seed=1)
+        target = InProcessTarget(
+            fake, args.workdir or tempfile.mkdtemp(prefix="tgbot-bench-"), args.no_limits
+        )
+
+    report = replay(target, updates, args.rate, args.concurrency)
+    target.drain(args.drain)
+    report["outbound"] = target.outbound()
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return report
+
+
+if __name__ == "__main__":
+    main()
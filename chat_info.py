@@ -0,0 +1,100 @@
+"""Получение данных о чате: сначала из update, потом из кеша, потом getChat"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ChatInfoResolver:
+    """Данные о чатах с LRU+TTL кешем перед getChat.
+
+    Одновременные промахи по одному чату ждут один общий запрос.
+    """
+
+    def __init__(self, fetch, maxsize=1024, ttl=600):
+        self.fetch = fetch
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.cache = OrderedDict()  # str(chat_id) -> (время записи, данные)
+        self.in_flight = {}  # str(chat_id) -> {"event", "result"}
+        self.lock = threading.Lock()
+        self.payload_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def from_update(chat_id, message_data):
+        """Ищет данные о чате в самом update"""
+        if not message_data:
+            return None
+        for key in ("chat", "from"):
+            info = message_data.get(key)
+            if info and str(info.get("id")) == str(chat_id):
+                return info
+        return None
+
+    def get(self, chat_id, message_data=None):
+        """Данные о чате или None, если Telegram их не вернул"""
+        key = str(chat_id)
+        info = self.from_update(chat_id, message_data)
+        if info is not None:
+            with self.lock:
+                self.payload_hits += 1
+                self._store(key, info)
+            return info
+
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached and time.monotonic() - cached[0] < self.ttl:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            waiter = self.in_flight.get(key)
+            if waiter is None:
+                waiter = {"event": threading.Event(), "result": None}
+                self.in_flight[key] = waiter
+                self.misses += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            waiter["event"].wait()
+            return waiter["result"]
+
+        result = None
+        try:
+            result = self.fetch(chat_id)
+        finally:
+            with self.lock:
+                if result is not None:
+                    self._store(key, result)
+                del self.in_flight[key]
+            waiter["result"] = result
+            waiter["event"].set()
+        return result
+
+    def _store(self, key, info):
+        """Кладет данные в кеш (вызывается под блокировкой)"""
+        self.cache[key] = (time.monotonic(), info)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, chat_id):
+        with self.lock:
+            self.cache.pop(str(chat_id), None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.cache),
+                "payload_hits": self.payload_hits,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,140 @@
+"""Выбор комментария без повторов: отдельный мешок перестановки на каждый чат"""
+import random
+import threading
+import zlib
+
+from state_backend import LocalState
+
+
+class CommentSelector:
+    """Выбирает комментарии по очереди из перемешанного списка.
+
+    За один проход мешка чата каждый комментарий выпадает ровно столько
+    раз, каков его вес (по умолчанию 1), поэтому все комментарии
+    гарантированно встречаются. Копии с весом разнесены по мешку, и один
+    комментарий не выпадает два раза подряд, в том числе на стыке мешков. Добавленные
+    комментарии вставляются в еще не пройденную часть мешка при
+    следующем выборе, удаленные пропускаются.
+
+    Мешки ({"order", "pos", "last", "version"}) лежат в хранилище
+    состояния и обновляются атомарно, поэтому процессы продолжают общую
+    очередь чата. version - контрольная сумма списка комментариев: пока
+    список не менялся, выбор не перебирает комментарии. Сумма считается
+    по содержимому, поэтому у процессов с одинаковым списком она совпадает.
+    """
+
+    def __init__(self, rng=None, state=None):
+        self.rng = rng or random.Random()
+        self.state = state or LocalState()
+        self.items = {}  # вид -> {комментарий: вес}
+        self.versions = {}  # вид -> контрольная сумма items[вид]
+        self.lock = threading.Lock()
+
+    def _changed(self, kind):
+        """Пересчитывает версию списка вида kind (вызывается под self.lock)"""
+        items = sorted(self.items.get(kind, {}).items(), key=repr)
+        self.versions[kind] = zlib.crc32(repr(items).encode("utf-8"))
+
+    def _snapshot(self, kind):
+        with self.lock:
+            return dict(self.items.get(kind) or {})
+
+    def set_items(self, kind, items, weights=None):
+        """Полностью задает список комментариев вида kind"""
+        with self.lock:
+            self.items[kind] = {
+                item: max(1, int(weights[num])) if weights else 1
+                for num, item in enumerate(items)
+            }
+            self._changed(kind)
+
+    def add(self, kind, item, weight=1):
+        with self.lock:
+            self.items.setdefault(kind, {})[item] = max(1, int(weight))
+            self._changed(kind)
+
+    def remove(self, kind, item):
+        with self.lock:
+            if self.items.get(kind, {}).pop(item, None) is not None:
+                self._changed(kind)
+
+    def pick(self, chat_id, kind):
+        """Следующий комментарий для чата или None, если комментариев нет"""
+        with self.lock:
+            items = self.items.get(kind)
+            version = self.versions.get(kind)
+        if not items:
+            return None
+
+        def advance(bag):
+            bag = bag or {"order": [], "pos": 0, "last": None, "version": version}
+            if bag.get("version") != version:
+                # Список менялся с прошлого выбора: дополняем мешок один раз
+                self._insert_new(bag, self._snapshot(kind))
+                bag["version"] = version
+            while True:
+                if bag["pos"] >= len(bag["order"]):
+                    self._refill(bag, self._snapshot(kind) or items)
+                item = bag["order"][bag["pos"]]
+                bag["pos"] += 1
+                # Комментарий удален после того, как мешок был собран
+                if item in items:
+                    bag["last"] = item
+                    return bag
+
+        return self.state.update("comment_bag", f"{chat_id}:{kind}", advance)["last"]
+
+    def _insert_new(self, bag, items):
+        """Вставляет в непройденную часть мешка комментарии, которых в нем нет.
+
+        Копия встает только между двумя другими комментариями, если такое
+        место есть, чтобы вставка не давала повтор подряд.
+        """
+        if not bag["order"]:
+            return
+        order = bag["order"]
+        present = set(order)
+        for item, weight in items.items():
+            if item in present:
+                continue
+            for _ in range(weight):
+                # Слева от первой непройденной позиции - последний выданный
+                places = [
+                    num for num in range(bag["pos"], len(order) + 1)
+                    if (order[num - 1] if num > bag["pos"] else bag["last"]) != item
+                    and (num == len(order) or order[num] != item)
+                ]
+                order.insert(
+                    self.rng.choice(places) if places else self.rng.randint(bag["pos"], len(order)),
+                    item,
+                )
+
+    def _refill(self, bag, items):
+        bag["order"] = self._spread(items, bag["last"])
+        bag["pos"] = 0
+
+    def _spread(self, items, last):
+        """Раскладывает копии комментариев так, чтобы одинаковые не шли подряд.
+
+        Следующий комментарий выбирается случайно с учетом оставшихся копий,
+        кроме предыдущего. Если копий одного комментария больше половины
+        остатка, берется он: иначе их уже не разделить. Когда повтор
+        неизбежен (комментарий занимает больше половины мешка), он приходится
+        на стык с прошлым мешком, а не на середину.
+        """
+        counts = dict(items)
+        total = sum(counts.values())
+        order = []
+        prev = last
+        while total:
+            heaviest = max(counts, key=counts.get)
+            candidates = [item for item, count in counts.items() if count and item != prev]
+            if counts[heaviest] * 2 > total or not candidates:
+                item = heaviest
+            else:
+                item = self.rng.choices(candidates, [counts[c] for c in candidates])[0]
+            order.append(item)
+            counts[item] -= 1
+            total -= 1
+            prev = item
+        return order
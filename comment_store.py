@@ -0,0 +1,163 @@
+"""Комментарии бота в SQLite с копией в памяти"""
+import json
+import logging
+import os
+import threading
+import time
+
+from comment_selector import CommentSelector
+from comment_templates import CommentTemplate
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("text", "photo")
+
+
+def create_comments_table(conn):
+    """Миграция: таблица комментариев и счетчик изменений"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            text TEXT NOT NULL,
+            weight INTEGER NOT NULL DEFAULT 1,
+            created_by INTEGER,
+            created_at REAL NOT NULL,
+            deleted_at REAL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_comments_type_deleted ON comments (type, deleted_at)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+    )
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('comments_rev', 0)")
+
+
+class CommentStore:
+    """Комментарии в таблице comments.
+
+    У каждого комментария постоянный id, удаление мягкое (deleted_at).
+    Выбор комментария идет по копии в памяти, которая обновляется при
+    записи. Другие процессы замечают изменения по счетчику comments_rev
+    (проверяется не чаще sync_interval секунд). Мешки выбора хранятся в
+    state (см. CommentSelector).
+    """
+
+    def __init__(self, db, legacy_json="comments.json", sync_interval=1.0, state=None):
+        self.db = db
+        self.sync_interval = sync_interval
+        self.selector = CommentSelector(state=state)
+        self.comments = {kind: {} for kind in KINDS}  # вид -> {id: CommentTemplate}
+        self.rev = None
+        self.last_sync = 0.0
+        self.lock = threading.Lock()
+        self.import_json(legacy_json)
+        self.load()
+
+    def import_json(self, path):
+        """Переносит комментарии из старого comments.json, если таблица пуста"""
+        if self.db.query_one("SELECT 1 FROM comments LIMIT 1") or not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            comment_data = json.load(f)
+        now = time.time()
+        statements = []
+        for kind in KINDS:
+            for data in comment_data.get(kind, []):
+                comment = CommentTemplate.from_json(data)
+                statements.append((
+                    "INSERT INTO comments (type, text, weight, created_at) VALUES (?, ?, ?, ?)",
+                    (kind, comment.text, comment.weight, now),
+                ))
+        statements.append(
+            ("UPDATE meta SET value = value + 1 WHERE key = 'comments_rev'", ())
+        )
+        self.db.transaction(statements)
+        logger.info("Импортировано комментариев из %s: %s", path, len(statements) - 1)
+
+    def _read_rev(self):
+        return self.db.query_one("SELECT value FROM meta WHERE key = 'comments_rev'")[0]
+
+    def load(self):
+        """Перечитывает все комментарии из базы"""
+        with self.lock:
+            rev = self._read_rev()
+            rows = self.db.query(
+                "SELECT id, type, text, weight FROM comments WHERE deleted_at IS NULL ORDER BY id"
+            )
+            comments = {kind: {} for kind in KINDS}
+            for comment_id, kind, text, weight in rows:
+                comments.setdefault(kind, {})[comment_id] = CommentTemplate(text, weight)
+            self.comments = comments
+            for kind, items in comments.items():
+                self.selector.set_items(kind, list(items), [c.weight for c in items.values()])
+            self.rev = rev
+            self.last_sync = time.monotonic()
+
+    def sync(self):
+        """Подхватывает изменения из других процессов"""
+        if time.monotonic() - self.last_sync < self.sync_interval:
+            return
+        self.last_sync = time.monotonic()
+        if self._read_rev() != self.rev:
+            self.load()
+
+    def _after_write(self):
+        """Обновляет известную ревизию; если писал кто-то еще, перечитывает все"""
+        rev = self._read_rev()
+        with self.lock:
+            if rev == self.rev + 1:
+                self.rev = rev
+                return
+        self.load()
+
+    def add(self, kind, text, created_by=None, weight=1):
+        """Добавляет комментарий, возвращает его id"""
+        results = self.db.transaction([
+            (
+                "INSERT INTO comments (type, text, weight, created_by, created_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, text, weight, created_by, time.time()),
+            ),
+            ("UPDATE meta SET value = value + 1 WHERE key = 'comments_rev'", ()),
+        ])
+        comment_id = results[0].lastrowid
+        with self.lock:
+            self.comments[kind][comment_id] = CommentTemplate(text, weight)
+            self.selector.add(kind, comment_id, weight)
+        self._after_write()
+        return comment_id
+
+    def delete(self, kind, comment_id):
+        """Мягко удаляет комментарий, возвращает его или None, если его нет"""
+        comment = self.comments.get(kind, {}).get(comment_id)
+        if comment is None:
+            return None
+        results = self.db.transaction([
+            (
+                "UPDATE comments SET deleted_at = ? WHERE id = ? AND type = ? AND deleted_at IS NULL",
+                (time.time(), comment_id, kind),
+            ),
+            ("UPDATE meta SET value = value + 1 WHERE key = 'comments_rev'", ()),
+        ])
+        with self.lock:
+            self.comments[kind].pop(comment_id, None)
+            self.selector.remove(kind, comment_id)
+        self._after_write()
+        return comment if results[0].rowcount else None
+
+    def list(self, kind):
+        """Список (id, комментарий) по возрастанию id"""
+        self.sync()
+        return list(self.comments.get(kind, {}).items())
+
+    def pick(self, chat_id, kind):
+        """Следующий комментарий для чата или None"""
+        self.sync()
+        comment_id = self.selector.pick(chat_id, kind)
+        if comment_id is None:
+            return None
+        return self.comments[kind].get(comment_id)
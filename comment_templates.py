@@ -0,0 +1,102 @@
+"""Шаблоны комментариев с подстановками {{name}}, {{company}} и т.п."""
+import logging
+import re
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = re.compile(r"{{(\w+)}}")
+
+
+class CommentTemplate:
+    """Комментарий, заранее разобранный на текст и подстановки"""
+
+    __slots__ = ("text", "weight", "segments", "placeholders")
+
+    def __init__(self, text, weight=1):
+        self.text = text
+        self.weight = weight
+        parts = PLACEHOLDER.split(text)
+        # split чередует текст и имена подстановок: [текст, имя, текст, имя, ...]
+        self.segments = tuple(
+            (bool(num % 2), part) for num, part in enumerate(parts) if part or num % 2
+        )
+        self.placeholders = tuple(part for is_name, part in self.segments if is_name)
+
+    @classmethod
+    def from_json(cls, data):
+        """Из записи comments.json: строка или {"text": ..., "weight": ...}"""
+        if isinstance(data, dict):
+            return cls(data["text"], int(data.get("weight", 1)))
+        return cls(data)
+
+    def to_json(self):
+        if self.weight == 1:
+            return self.text
+        return {"text": self.text, "weight": self.weight}
+
+    def render(self, pool):
+        """Текст комментария со значениями из pool"""
+        if not self.placeholders:
+            return self.text
+        return "".join(
+            pool.take(part) if is_name else part for is_name, part in self.segments
+        )
+
+    def __repr__(self):
+        return f"CommentTemplate({self.text!r})"
+
+
+class FakerPool:
+    """Кольцевые буферы заранее сгенерированных значений для подстановок.
+
+    Буферы пополняет фоновый поток, поэтому при отправке комментария
+    Faker не вызывается. Если буфер все-таки опустел, значение
+    генерируется на месте.
+    """
+
+    def __init__(self, generators, size=64, low_water=16):
+        self.generators = generators
+        self.size = size
+        self.low_water = low_water
+        self.buffers = {name: deque(maxlen=size) for name in generators}
+        self.need_refill = threading.Event()
+        self.thread = None
+        self.misses = 0
+
+    def take(self, name):
+        buffer = self.buffers.get(name)
+        if buffer is None:
+            # Неизвестная подстановка остается в тексте как есть
+            return "{{" + name + "}}"
+        if len(buffer) < self.low_water:
+            self.refill()
+        try:
+            return buffer.popleft()
+        except IndexError:
+            self.misses += 1
+            return self.generators[name]()
+
+    def refill(self):
+        """Просит фоновый поток пополнить буферы"""
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="faker-pool", daemon=True)
+            self.thread.start()
+        self.need_refill.set()
+
+    def fill(self):
+        """Заполняет все буферы до конца"""
+        for name, buffer in self.buffers.items():
+            generate = self.generators[name]
+            while len(buffer) < self.size:
+                buffer.append(generate())
+
+    def _run(self):
+        while True:
+            self.need_refill.wait()
+            self.need_refill.clear()
+            try:
+                self.fill()
+            except Exception as e:
+                logger.error("Ошибка пополнения значений Faker: %s", e)
@@ -0,0 +1,214 @@
+"""Хранилище logged_msgs: снимок + журнал добавлений"""
+import heapq
+import json
+import logging
+import os
+import threading
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+
+class LoggedMsgsStore(MutableMapping):
+    """Словарь "сообщение в логгер-чате -> исходное сообщение".
+
+    Каждое изменение дописывается одной строкой в журнал, а не
+    перезаписывает весь файл. Когда журнал вырастает, в фоне пишется
+    новый снимок, а журнал начинается заново. При запуске индекс
+    восстанавливается из снимка и хвоста журнала.
+
+    Записи с "timestamp" дополнительно лежат в куче по времени, поэтому
+    удаление старых записей стоит столько, сколько записей устарело.
+    """
+
+    def __init__(self, path="logged_msgs.json", journal_path=None, compact_every=1000, fsync=False):
+        self.path = path
+        self.journal_path = journal_path or os.path.splitext(path)[0] + ".journal"
+        # Журнал, который сейчас сворачивается в снимок
+        self.compacting_path = self.journal_path + ".compacting"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.data = {}
+        self.expiry = []  # куча (timestamp, ключ), устаревшие элементы пропускаются
+        self.lock = threading.RLock()
+        self.compact_lock = threading.Lock()
+        self.journal = None
+        self.journal_records = 0
+        self.load()
+
+    def load(self):
+        """Восстанавливает данные из снимка и журналов"""
+        with self.lock:
+            self.data = self._read_snapshot()
+            for path in (self.compacting_path, self.journal_path):
+                self._repair_tail(path)
+                self.journal_records = self._replay(path)
+            self.expiry = [
+                (value["timestamp"], key)
+                for key, value in self.data.items()
+                if isinstance(value, dict) and "timestamp" in value
+            ]
+            heapq.heapify(self.expiry)
+            self.journal = open(self.journal_path, "a", encoding="utf-8")
+            logger.info("Загружено logged_msgs: %s", len(self.data))
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except json.JSONDecodeError as e:
+            logger.error("Ошибка декодирования JSON в %s: %s", self.path, e)
+            return {}
+        except Exception as e:
+            logger.error("Ошибка загрузки logged_msgs: %s", e)
+            return {}
+        if not isinstance(data, dict):
+            logger.error("Некорректный формат данных в %s, ожидается словарь", self.path)
+            return {}
+        return data
+
+    @staticmethod
+    def _repair_tail(path):
+        """Обрезает недописанную последнюю строку журнала после падения процесса.
+
+        Иначе следующая запись дописалась бы в ту же строку, и обе
+        пропадали бы при каждом следующем запуске.
+        """
+        if not os.path.exists(path):
+            return
+        with open(path, "rb+") as f:
+            data = f.read()
+            if not data or data.endswith(b"\n"):
+                return
+            keep = data.rfind(b"\n") + 1
+            logger.warning(
+                "Обрезана недописанная запись журнала %s (%s байт)", path, len(data) - keep
+            )
+            f.truncate(keep)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay(self, path):
+        """Применяет записи журнала, возвращает их количество"""
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная строка после падения процесса
+                    logger.warning("Пропущена поврежденная запись журнала %s", path)
+                    continue
+                self._apply(record)
+                count += 1
+        return count
+
+    def _apply(self, record):
+        if record.get("d"):
+            self.data.pop(record["k"], None)
+        else:
+            self.data[record["k"]] = record["v"]
+
+    def _write(self, records):
+        """Дописывает записи в журнал (вызывается под блокировкой)"""
+        self.journal.write(
+            "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        )
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+        self.journal_records += len(records)
+        if self.journal_records >= self.compact_every and not self.compact_lock.locked():
+            threading.Thread(target=self.compact, name="logged-msgs-compact", daemon=True).start()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            if isinstance(value, dict) and "timestamp" in value:
+                heapq.heappush(self.expiry, (value["timestamp"], key))
+            self._write([{"k": key, "v": value}])
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self.data[key]
+            self._write([{"k": key, "d": 1}])
+
+    def delete_many(self, keys):
+        """Удаляет несколько ключей одной записью в журнал"""
+        with self.lock:
+            removed = [key for key in keys if self.data.pop(key, None) is not None]
+            if removed:
+                self._write([{"k": key, "d": 1} for key in removed])
+            return removed
+
+    def expire(self, older_than):
+        """Удаляет записи с timestamp меньше older_than, возвращает их ключи"""
+        with self.lock:
+            keys = []
+            while self.expiry and self.expiry[0][0] < older_than:
+                timestamp, key = heapq.heappop(self.expiry)
+                value = self.data.get(key)
+                # Ключ уже удален или перезаписан с новым временем
+                if isinstance(value, dict) and value.get("timestamp") == timestamp:
+                    keys.append(key)
+            return self.delete_many(keys)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.data))
+
+    def __len__(self):
+        return len(self.data)
+
+    def items(self):
+        with self.lock:
+            return list(self.data.items())
+
+    def compact(self):
+        """Пишет новый снимок и начинает журнал заново"""
+        if not self.compact_lock.acquire(blocking=False):
+            return
+        try:
+            with self.lock:
+                snapshot = dict(self.data)
+                self.journal.close()
+                if os.path.exists(self.compacting_path):
+                    # Прошлое сворачивание не завершилось: дописываем текущий журнал к нему
+                    with open(self.journal_path, "r", encoding="utf-8") as src, open(
+                        self.compacting_path, "a", encoding="utf-8"
+                    ) as dst:
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                elif os.path.exists(self.journal_path):
+                    os.replace(self.journal_path, self.compacting_path)
+                self.journal = open(self.journal_path, "a", encoding="utf-8")
+                self.journal_records = 0
+
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+            logger.info("logged_msgs: записан снимок (%s записей)", len(snapshot))
+        except Exception as e:
+            logger.error("Ошибка сворачивания журнала logged_msgs: %s", e)
+        finally:
+            self.compact_lock.release()
+
+    def close(self):
+        with self.lock:
+            if self.journal and not self.journal.closed:
+                self.journal.close()
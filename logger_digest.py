@@ -0,0 +1,105 @@
+"""Сводки для логгер-чата: несколько строк одним сообщением"""
+import logging
+import threading
+import time
+
+from pagination import shorten
+
+logger = logging.getLogger(__name__)
+
+
+class LoggerDigest:
+    """Копит строки для логгер-чата и отправляет их одним сообщением.
+
+    Сводка уходит, когда набралось max_lines строк или max_chars
+    символов, либо через interval секунд после первой строки. Строки
+    нумеруются с 1; после отправки on_flushed(message_id, origins)
+    получает id сводки и источники строк в том же порядке.
+    """
+
+    def __init__(self, send, on_flushed, max_lines=20, max_chars=3500, interval=10, line_limit=500):
+        self.send = send
+        self.on_flushed = on_flushed
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+        self.interval = interval
+        self.line_limit = line_limit
+        self.lines = []  # (строка, источник)
+        self.chars = 0
+        self.deadline = None
+        self.cond = threading.Condition()
+        self.thread = None
+        self.flushed = 0
+
+    def add(self, line, origin):
+        """Добавляет строку; origin - данные для /answer (chat_id, message_id)"""
+        line = shorten(line, self.line_limit)
+        with self.cond:
+            self._ensure_thread()
+            # Строка не влезает в текущую сводку - сначала отправляем накопленное
+            if self.lines and self.chars + len(line) > self.max_chars:
+                self.deadline = time.monotonic()
+            self.lines.append((line, origin))
+            self.chars += len(line) + 8
+            if self.deadline is None:
+                self.deadline = time.monotonic() + self.interval
+            if len(self.lines) >= self.max_lines:
+                self.deadline = time.monotonic()
+            self.cond.notify()
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="logger-digest", daemon=True)
+            self.thread.start()
+
+    def _take(self):
+        """Забирает строки для очередной сводки (под блокировкой)"""
+        batch, chars = [], 0
+        while self.lines and len(batch) < self.max_lines:
+            line, origin = self.lines[0]
+            if batch and chars + len(line) + 8 > self.max_chars:
+                break
+            batch.append(self.lines.pop(0))
+            chars += len(line) + 8
+        self.chars -= chars
+        self.deadline = (time.monotonic() + self.interval) if self.lines else None
+        if self.lines and (len(self.lines) >= self.max_lines or self.chars > self.max_chars):
+            self.deadline = time.monotonic()
+        return batch
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.deadline is None or self.deadline > time.monotonic():
+                    self.cond.wait(
+                        None if self.deadline is None else self.deadline - time.monotonic()
+                    )
+                batch = self._take()
+            if batch:
+                self.flush_batch(batch)
+
+    def flush_batch(self, batch):
+        text = "\n".join(f"#{num}. {line}" for num, (line, _) in enumerate(batch, start=1))
+        try:
+            msg = self.send(text)
+        except Exception as e:
+            logger.error("Ошибка отправки сводки: %s", e)
+            return
+        if msg and msg.get("ok"):
+            self.flushed += 1
+            self.on_flushed(msg["result"]["message_id"], [origin for _, origin in batch])
+        else:
+            logger.error("Сводка не отправлена: %s", msg)
+
+    def flush(self):
+        """Немедленно отправляет все накопленное"""
+        with self.cond:
+            batches = []
+            while self.lines:
+                batches.append(self._take())
+        for batch in batches:
+            self.flush_batch(batch)
+
+    def stats(self):
+        with self.cond:
+            return {"buffered": len(self.lines), "flushed": self.flushed}
@@ -11,6 +11,7 @@ from dotenv import load_dotenv
 from os import getenv
 from comments import comments, ph_comments
 from banwords import banwords
+from banword_matcher import BanwordMatcher
 
 load_dotenv()
 
@@ -19,6 +20,7 @@ logger = logging.getLogger(__name__)
 
 bot = Bot(token=getenv("BOT_TOKEN"))
 dp = Dispatcher()
+banword_matcher = BanwordMatcher(banwords, re.IGNORECASE | re.MULTILINE)
 
 
 # Команда /start - работает везде
@@ -95,9 +97,9 @@ async def handle_group_message(message: types.Message):
         else:
             logger.info("skip")
     else:
-        for key in banwords.keys():
-            if re.search(key, message.text, re.IGNORECASE | re.MULTILINE):
-                await message.reply(banwords.get(key, "нельзя"))
+        found = banword_matcher.match(message.text)
+        if found:
+            await message.reply(found[1])
 
 
 @dp.message(Command("/stats"))
@@ -0,0 +1,134 @@
+"""Сборка альбомов (media_group_id) без блокировки обработчика"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from metrics import STAGE_SECONDS
+from state_backend import LocalState
+
+logger = logging.getLogger(__name__)
+
+
+class MediaGroupAggregator:
+    """Собирает части альбома и вызывает on_complete один раз на альбом.
+
+    Каждая новая часть продлевает окно ожидания (debounce). Части и срок
+    альбома лежат в хранилище состояния, поэтому части одного альбома
+    могут приходить в разные процессы. Когда окно истекает, альбом
+    забирает тот процесс, который первым записал отметку "обработан".
+    Локальная куча сроков нужна только чтобы вовремя проснуться.
+    """
+
+    def __init__(self, on_complete, window=1.5, forget_after=30, state=None):
+        self.on_complete = on_complete
+        self.window = window
+        # Сколько помнить уже обработанный альбом, чтобы опоздавшие части не сработали повторно
+        self.forget_after = forget_after
+        self.state = state or LocalState()
+        self.heap = []  # куча (срок, номер, media_group_id)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        # Истекшие строки album/album_done в SQLite сами не удаляются
+        self.next_purge = time.time() + forget_after
+
+    def add(self, media_group_id, message_data):
+        """Добавляет часть альбома, возвращает False если альбом уже обработан"""
+        if self.state.get("album_done", media_group_id):
+            logger.info("Опоздавшая часть альбома %s, пропускаем", media_group_id)
+            return False
+        now = time.time()
+        deadline = now + self.window
+
+        def append(group):
+            group = group or {"parts": [], "first": now}
+            group["parts"].append(message_data)
+            group["deadline"] = max(group.get("deadline", 0), deadline)
+            return group
+
+        self.state.update(
+            "album", media_group_id, append, ttl=self.window + self.forget_after
+        )
+        with self.cond:
+            self._ensure_thread()
+            heapq.heappush(self.heap, (deadline, next(self.seq), media_group_id))
+            self.cond.notify()
+        return True
+
+    def pending(self):
+        with self.cond:
+            return len({media_group_id for _, _, media_group_id in self.heap})
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(
+                target=self._run, name="media-group-timer", daemon=True
+            )
+            self.thread.start()
+
+    def _pop_due(self):
+        """Забирает из кучи альбомы с истекшим сроком (вызывается под блокировкой)"""
+        now = time.time()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, media_group_id = heapq.heappop(self.heap)
+            if media_group_id not in due:
+                due.append(media_group_id)
+        return due
+
+    def _claim(self, media_group_id):
+        """Части альбома, если его окно истекло и он достался этому процессу"""
+        group = self.state.get("album", media_group_id)
+        # Альбом уже забрал другой процесс
+        if group is None:
+            return None
+        if group["deadline"] > time.time():
+            # Окно продлено частью, пришедшей в другой процесс
+            with self.cond:
+                heapq.heappush(
+                    self.heap, (group["deadline"], next(self.seq), media_group_id)
+                )
+            return None
+        if not self.state.add("album_done", media_group_id, True, ttl=self.forget_after):
+            return None
+        # Забираем и удаляем части одной операцией, чтобы не потерять дописанные
+        taken = []
+
+        def take(current):
+            taken.append(current)
+            return None
+
+        self.state.update("album", media_group_id, take)
+        group = taken[0] or group
+        # Сколько альбом ждал с первой части до обработки
+        STAGE_SECONDS.observe(time.time() - group.get("first", group["deadline"]), "album_wait")
+        return group["parts"]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                due = self._pop_due()
+                while not due and time.time() < self.next_purge:
+                    wake = min(self.heap[0][0], self.next_purge) if self.heap else self.next_purge
+                    self.cond.wait(max(0.0, wake - time.time()))
+                    due = self._pop_due()
+            for media_group_id in due:
+                try:
+                    parts = self._claim(media_group_id)
+                    if parts:
+                        self.on_complete(media_group_id, parts)
+                except Exception as e:
+                    logger.error("Ошибка обработки альбома %s: %s", media_group_id, e, exc_info=True)
+            if time.time() >= self.next_purge:
+                self.next_purge = time.time() + self.forget_after
+                self._purge()
+
+    def _purge(self):
+        """Удаляет истекшие отметки обработанных альбомов и брошенные части"""
+        try:
+            for ns in ("album_done", "album"):
+                self.state.purge(ns)
+        except Exception as e:
+            logger.error("Ошибка очистки состояния альбомов: %s", e)
@@ -0,0 +1,214 @@
+"""Метрики бота в формате Prometheus: счетчики, гистограммы и замеры этапов
+
+Запись - словарь и bisect под блокировкой, поэтому замеры можно держать
+включенными постоянно. Текст для /tgbot/metrics собирается только по запросу.
+"""
+import bisect
+import math
+import threading
+import time
+from functools import wraps
+
+# Границы корзин в секундах: от быстрых проверок в памяти до запросов к Telegram
+DEFAULT_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # значения меток -> число
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in values]
+
+
+class Histogram:
+    """Гистограмма длительностей с метками"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # значения меток -> [счетчики корзин..., +Inf, сумма]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += value
+
+    def render(self):
+        with self.lock:
+            values = [(labels, list(entry)) for labels, entry in self.values.items()]
+        lines = []
+        for labels, entry in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), entry):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            suffix = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_number(entry[-1])}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+class Collected:
+    """Значения, которые берутся из fn() в момент выгрузки.
+
+    fn возвращает число, словарь {значение метки: число} или None,
+    если источника пока нет (например, бот еще не создан).
+    """
+
+    def __init__(self, name, help, fn, kind="gauge", labelname=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        self.labelname = labelname
+
+    def render(self):
+        value = self.fn()
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            return [f"{self.name} {_number(value)}"]
+        return [
+            f"{self.name}{_labels((self.labelname,), (label,))} {_number(number)}"
+            for label, number in value.items()
+        ]
+
+
+class Registry:
+    """Набор метрик, выгружаемых одним текстом"""
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def collect(self, name, help, fn, kind="gauge", labelname=None):
+        return self._register(Collected(name, help, fn, kind, labelname))
+
+    def render(self):
+        """Текст в формате Prometheus (text/plain; version=0.0.4)"""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.render()
+            except Exception as e:
+                samples = [f"# {metric.name}: ошибка сбора: {type(e).__name__}"]
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "tgbot_stage_seconds", "Длительность этапов обработки update", ("stage",)
+)
+TELEGRAM_SECONDS = REGISTRY.histogram(
+    "tgbot_telegram_request_seconds", "Длительность вызовов Bot API", ("method",)
+)
+TELEGRAM_ERRORS = REGISTRY.counter(
+    "tgbot_telegram_errors_total", "Вызовы Bot API, завершившиеся ошибкой", ("method",)
+)
+UPDATES = REGISTRY.counter(
+    "tgbot_updates_total", "Обработанные update по типу", ("type",)
+)
+WEBHOOK_RESPONSES = REGISTRY.counter(
+    "tgbot_webhook_responses_total", "Ответы вебхука по статусу", ("status",)
+)
+
+
+class span:
+    """Замер этапа: with span("banwords"): ...
+
+    Длительность попадает в tgbot_stage_seconds, даже если внутри
+    было исключение.
+    """
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_SECONDS.observe(time.perf_counter() - self.start, self.stage)
+        return False
+
+
+def timed(stage):
+    """Декоратор: весь вызов функции замеряется как этап stage"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+        return wrapper
+
+    return decorator
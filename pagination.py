@@ -0,0 +1,70 @@
+"""Постраничный вывод списков с кнопками навигации"""
+import threading
+import time
+from collections import OrderedDict
+
+# Лимит Telegram на длину сообщения - 4096 символов, оставляем запас
+MAX_MESSAGE_LEN = 4000
+
+
+def shorten(text, limit):
+    """Обрезает строку до limit символов"""
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+def nav_keyboard(prev_data=None, next_data=None, extra=()):
+    """Inline-клавиатура ◀ / ▶ и дополнительный ряд кнопок (текст, callback_data)"""
+    rows = []
+    nav = []
+    if prev_data:
+        nav.append({"text": "◀", "callback_data": prev_data})
+    if next_data:
+        nav.append({"text": "▶", "callback_data": next_data})
+    if nav:
+        rows.append(nav)
+    if extra:
+        rows.append([{"text": text, "callback_data": data} for text, data in extra])
+    return {"inline_keyboard": rows} if rows else None
+
+
+class PageCache:
+    """Кеш отрисованных страниц.
+
+    Страница хранится вместе с версией данных, из которых она
+    построена; при смене версии кеш для нее считается устаревшим.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.pages = OrderedDict()  # ключ -> (версия, время, страница)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self.lock:
+            cached = self.pages.get(key)
+            if cached and cached[0] == version and time.monotonic() - cached[1] < self.ttl:
+                self.pages.move_to_end(key)
+                self.hits += 1
+                return cached[2]
+            self.misses += 1
+            return None
+
+    def put(self, key, version, page):
+        with self.lock:
+            self.pages[key] = (version, time.monotonic(), page)
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.maxsize:
+                self.pages.popitem(last=False)
+
+    def invalidate(self, prefix):
+        """Сбрасывает страницы, ключ которых начинается с prefix"""
+        with self.lock:
+            for key in [key for key in self.pages if key[0] == prefix]:
+                del self.pages[key]
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.pages), "hits": self.hits, "misses": self.misses}
@@ -1,9 +1,22 @@
 import sys
 import os
+import time
+import logging
+
+_started = time.perf_counter()
 
 # Добавляем текущую директорию в путь
 sys.path.insert(0, os.path.dirname(__file__))
 
 # Импортируем наше приложение
-from app import application
-print("123")
\ No newline at end of file
+from app import STARTUP, application, warm_up_async
+
+STARTUP["wsgi_import"] = round(time.perf_counter() - _started, 4)
+# Логирование уже настроено при импорте app
+logging.getLogger(__name__).info(
+    "Приложение импортировано за %s с (app.py: %s с)", STARTUP["wsgi_import"], STARTUP["app_import"]
+)
+
+# Бот, базы и Faker создаются в фоне, чтобы первый вебхук не ждал их с нуля
+if os.getenv("WARMUP", "1") == "1":
+    warm_up_async()
@@ -0,0 +1,54 @@
+"""Кеш прав пользователей из таблицы users"""
+import logging
+
+from state_backend import LocalState
+
+logger = logging.getLogger(__name__)
+
+
+class PermissionCache:
+    """Права всех пользователей в хранилище состояния.
+
+    Загружается при запуске и обновляется при каждой записи в users,
+    поэтому проверка прав не обращается к базе. С общим хранилищем
+    изменение прав в одном процессе сразу видно остальным.
+    """
+
+    def __init__(self, state=None):
+        self.state = state or LocalState()
+
+    @staticmethod
+    def _key(chat_id):
+        return int(chat_id)
+
+    def load(self, db):
+        """Загружает права всех пользователей из базы"""
+        rows = db.query("SELECT chat_id, permission FROM users")
+        permissions = {self._key(chat_id): int(permission or 0) for chat_id, permission in rows}
+        self.state.set_many("permission", permissions)
+        # Пользователи, которых больше нет в базе
+        for chat_id, _ in self.state.items("permission"):
+            if int(chat_id) not in permissions:
+                self.state.delete("permission", chat_id)
+        logger.info("Загружены права пользователей: %s", len(rows))
+
+    def get(self, chat_id):
+        """Уровень прав или None, если пользователя нет в базе"""
+        return self.state.get("permission", self._key(chat_id))
+
+    def set(self, chat_id, permission):
+        self.state.set("permission", self._key(chat_id), int(permission))
+
+    def check(self, db):
+        """Сверяет кеш с базой, возвращает список расхождений (chat_id, кеш, база)"""
+        rows = db.query("SELECT chat_id, permission FROM users")
+        in_db = {self._key(chat_id): int(permission or 0) for chat_id, permission in rows}
+        cached = {int(chat_id): value for chat_id, value in self.state.items("permission")}
+        mismatches = [
+            (chat_id, cached.get(chat_id), in_db.get(chat_id))
+            for chat_id in sorted(set(in_db) | set(cached))
+            if cached.get(chat_id) != in_db.get(chat_id)
+        ]
+        if mismatches:
+            logger.warning("Кеш прав расходится с базой: %s", mismatches)
+        return mismatches
@@ -0,0 +1,367 @@
+"""Планировщик исходящих запросов с учетом лимитов Telegram"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0  # ответы в чатах
+PRIORITY_LOW = 1  # зеркалирование в логгер-чат и служебные сообщения
+
+# Вызовы, которые не являются сообщениями и не тратят лимит чата (20 в минуту
+# для групп): у них своя очередь в чате без ведра, общий лимит действует
+UNMETERED_METHODS = frozenset({"setMessageReaction"})
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд будет доступен токен"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Lane:
+    """Очередь запросов одного чата"""
+
+    __slots__ = ("key", "bucket", "jobs", "blocked_until", "in_flight")
+
+    def __init__(self, key, bucket):
+        self.key = key
+        self.bucket = bucket
+        self.jobs = []  # куча (приоритет, номер, задание)
+        self.blocked_until = 0.0  # до этого времени чат под flood control
+        self.in_flight = False
+
+
+class OutboundScheduler:
+    """Все исходящие вызовы Bot API проходят через этот планировщик.
+
+    Общий лимит ~30 запросов/с, для групп ~20 сообщений в минуту, для
+    личных чатов ~1 в секунду. Запросы одного чата выполняются по
+    одному, сначала с высоким приоритетом. Ответ 429 блокирует только
+    свой чат на retry_after секунд, после чего запрос повторяется.
+    Реакции идут отдельной очередью чата и тратят только общий лимит.
+    """
+
+    def __init__(
+        self,
+        api,
+        global_rate=30,
+        group_rate=20 / 60,
+        group_burst=20,
+        private_rate=1,
+        private_burst=3,
+        workers=4,
+        max_retries=3,
+    ):
+        self.api = api
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.lanes = {}
+        self.ready = []  # куча (приоритет, номер, ключ чата)
+        self.timers = []  # куча (время, номер, ключ чата)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.executor = None
+        self.last_sweep = time.monotonic()
+        # Метрики ожидания по приоритетам
+        self.waits = {}  # приоритет -> {"count", "total", "max"}
+        self.flood_waits = 0
+        self.inline_replies = 0
+        # Отложенный вызов для ответа на вебхук, свой у каждого потока
+        self.local = threading.local()
+
+    def _bucket_for(self, chat_id):
+        if chat_id is None:
+            return None
+        if str(chat_id).startswith("-"):
+            return TokenBucket(self.group_rate, self.group_burst)
+        return TokenBucket(self.private_rate, self.private_burst)
+
+    def submit(self, method, payload=None, chat_id=None, priority=PRIORITY_HIGH):
+        """Ставит вызов в очередь, возвращает Future с ответом Telegram"""
+        # Отложенный вызов был раньше - он должен уйти первым
+        self._flush_deferred()
+        return self._enqueue(method, payload, chat_id, priority)
+
+    def _enqueue(self, method, payload, chat_id, priority):
+        future = Future()
+        job = {
+            "seq": next(self.seq),
+            "method": method,
+            "payload": payload,
+            "priority": priority,
+            "future": future,
+            "queued_at": time.monotonic(),
+            "retries": 0,
+        }
+        key = None if chat_id is None else str(chat_id)
+        unmetered = key is not None and method in UNMETERED_METHODS
+        if unmetered:
+            key = f"{key}:{method}"
+        with self.cond:
+            self._ensure_thread()
+            lane = self.lanes.get(key)
+            if lane is None:
+                bucket = None if unmetered else self._bucket_for(chat_id)
+                lane = self.lanes[key] = Lane(key, bucket)
+            heapq.heappush(lane.jobs, (priority, job["seq"], job))
+            self._schedule(lane, time.monotonic())
+            self.cond.notify()
+        return future
+
+    def send(self, method, payload=None, chat_id=None, priority=PRIORITY_HIGH):
+        """Вызов без ожидания результата и без ответа на вебхук; ошибки пишутся в лог"""
+        self._flush_deferred()
+        self._enqueue_detached((method, payload, chat_id, priority))
+
+    def call(self, method, payload=None, chat_id=None, priority=PRIORITY_HIGH):
+        """Вызов с ожиданием результата"""
+        return self.submit(method, payload, chat_id, priority).result()
+
+    def defer(self, method, payload=None, chat_id=None, priority=PRIORITY_HIGH):
+        """Вызов без ожидания результата.
+
+        Внутри capture_reply() вызов откладывается: если после него в
+        этом потоке ничего не отправлялось, он уходит в теле ответа на
+        вебхук. Иначе ставится в очередь, как обычно.
+        """
+        capture = getattr(self.local, "capture", None)
+        if capture is None:
+            self._enqueue_detached((method, payload, chat_id, priority))
+            return
+        self._flush_deferred()
+        capture["pending"] = (method, payload, chat_id, priority)
+
+    def _flush_deferred(self):
+        capture = getattr(self.local, "capture", None)
+        if capture and capture["pending"]:
+            pending, capture["pending"] = capture["pending"], None
+            self._enqueue_detached(pending)
+
+    def _enqueue_detached(self, pending):
+        """Ставит в очередь вызов, результат которого никто не ждет"""
+        method = pending[0]
+
+        def log_failure(future):
+            error = future.exception()
+            if error is not None:
+                logger.error("Ошибка вызова %s: %s", method, error)
+            elif not future.result().get("ok"):
+                logger.warning("Вызов %s не удался: %s", method, future.result())
+
+        self._enqueue(*pending).add_done_callback(log_failure)
+
+    @contextmanager
+    def capture_reply(self):
+        """Собирает вызов для ответа на вебхук: capture["reply"] после выхода"""
+        capture = self.local.capture = {"pending": None, "reply": None}
+        try:
+            yield capture
+            pending, capture["pending"] = capture["pending"], None
+            if pending:
+                method, payload, chat_id, priority = pending
+                if self._try_acquire(chat_id):
+                    capture["reply"] = {"method": method, **(payload or {})}
+                else:
+                    self._enqueue_detached(pending)
+        finally:
+            self.local.capture = None
+            # Обработка упала - отложенный вызов все равно отправляем
+            if capture["pending"]:
+                self._enqueue_detached(capture["pending"])
+
+    def _try_acquire(self, chat_id):
+        """Берет токены для вызова в обход очереди, если чат свободен"""
+        key = None if chat_id is None else str(chat_id)
+        with self.cond:
+            now = time.monotonic()
+            lane = self.lanes.get(key)
+            if lane is None:
+                lane = self.lanes[key] = Lane(key, self._bucket_for(chat_id))
+            # Очередь чата не пуста - ответ на вебхук обогнал бы ее
+            if lane.jobs or lane.in_flight or lane.blocked_until > now:
+                return False
+            if self.global_bucket.wait_time(now) > 0:
+                return False
+            if lane.bucket is not None and lane.bucket.wait_time(now) > 0:
+                return False
+            self.global_bucket.consume(now)
+            if lane.bucket is not None:
+                lane.bucket.consume(now)
+            self.inline_replies += 1
+            return True
+
+    def _ensure_thread(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="outbound"
+            )
+            self.thread = threading.Thread(
+                target=self._run, name="outbound-dispatcher", daemon=True
+            )
+            self.thread.start()
+
+    def _schedule(self, lane, now):
+        """Кладет чат в очередь готовых или в таймеры (под блокировкой)"""
+        if not lane.jobs or lane.in_flight:
+            return
+        ready_at = lane.blocked_until
+        if lane.bucket is not None:
+            ready_at = max(ready_at, now + lane.bucket.wait_time(now))
+        if ready_at <= now:
+            heapq.heappush(self.ready, (lane.jobs[0][0], next(self.seq), lane.key))
+        else:
+            heapq.heappush(self.timers, (ready_at, next(self.seq), lane.key))
+
+    def _next_job(self):
+        """Выбирает следующее задание или время ожидания (под блокировкой)"""
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, key = heapq.heappop(self.timers)
+            lane = self.lanes.get(key)
+            if lane is not None:
+                self._schedule(lane, now)
+        while self.ready:
+            wait = self.global_bucket.wait_time(now)
+            if wait > 0:
+                return None, wait
+            _, _, key = heapq.heappop(self.ready)
+            lane = self.lanes.get(key)
+            # Чат мог попасть в очередь несколько раз - лишние записи пропускаем
+            if lane is None or not lane.jobs or lane.in_flight:
+                continue
+            if lane.blocked_until > now or (
+                lane.bucket is not None and lane.bucket.wait_time(now) > 0
+            ):
+                self._schedule(lane, now)
+                continue
+            self.global_bucket.consume(now)
+            if lane.bucket is not None:
+                lane.bucket.consume(now)
+            _, _, job = heapq.heappop(lane.jobs)
+            if lane.key is None:
+                # Запросы без чата (getChat и т.п.) не упорядочиваем - могут идти параллельно
+                self._schedule(lane, now)
+            else:
+                lane.in_flight = True
+            return (lane, job), 0
+        if now - self.last_sweep > 60:
+            self._sweep(now)
+        return None, (self.timers[0][0] - now) if self.timers else None
+
+    def _sweep(self, now):
+        """Удаляет простаивающие чаты с полным ведром"""
+        self.last_sweep = now
+        for key in [
+            key
+            for key, lane in self.lanes.items()
+            if not lane.jobs
+            and not lane.in_flight
+            and lane.blocked_until <= now
+            and (lane.bucket is None or lane.bucket.full(now))
+        ]:
+            del self.lanes[key]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                picked, wait = self._next_job()
+                while picked is None:
+                    self.cond.wait(wait)
+                    picked, wait = self._next_job()
+            lane, job = picked
+            self._record_wait(job)
+            self.executor.submit(self._execute, lane, job)
+
+    def _record_wait(self, job):
+        waited = time.monotonic() - job["queued_at"]
+        with self.cond:
+            stat = self.waits.setdefault(
+                job["priority"], {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            stat["count"] += 1
+            stat["total"] += waited
+            stat["max"] = max(stat["max"], waited)
+
+    def _execute(self, lane, job):
+        future = job["future"]
+        try:
+            result = self.api.call(job["method"], job["payload"])
+        except Exception as e:
+            with self.cond:
+                lane.in_flight = False
+                self._schedule(lane, time.monotonic())
+                self.cond.notify()
+            future.set_exception(e)
+            return
+
+        with self.cond:
+            lane.in_flight = False
+            now = time.monotonic()
+            if result.get("error_code") == 429 and job["retries"] < self.max_retries:
+                retry_after = result.get("parameters", {}).get("retry_after", 5)
+                logger.warning(
+                    "Flood control в чате %s: ждем %s с (%s)", lane.key, retry_after, job["method"]
+                )
+                self.flood_waits += 1
+                lane.blocked_until = now + retry_after
+                job["retries"] += 1
+                # Прежний номер сохраняет порядок запросов внутри чата
+                heapq.heappush(lane.jobs, (job["priority"], job["seq"], job))
+                self._schedule(lane, now)
+                self.cond.notify()
+                return
+            self._schedule(lane, now)
+            self.cond.notify()
+        future.set_result(result)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "queued": sum(len(lane.jobs) for lane in self.lanes.values()),
+                "chats": len(self.lanes),
+                "flood_waits": self.flood_waits,
+                "inline_replies": self.inline_replies,
+                "wait": {
+                    ("high" if priority == PRIORITY_HIGH else "low"): {
+                        **stat,
+                        "avg": stat["total"] / stat["count"] if stat["count"] else 0.0,
+                    }
+                    for priority, stat in self.waits.items()
+                },
+            }
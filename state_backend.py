@@ -0,0 +1,309 @@
+"""Общее состояние бота: в памяти процесса или в SQLite для нескольких процессов"""
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LocalState:
+    """Состояние в памяти одного процесса.
+
+    Значения хранятся по паре (пространство имен, ключ). Ключи
+    приводятся к строке, как и в SQLiteState. Записи с ttl лежат в куче
+    по времени истечения и удаляются при следующих записях.
+    """
+
+    def __init__(self):
+        self.data = {}  # пространство имен -> {ключ: (значение, expires_at)}
+        self.expiry = []  # куча (expires_at, пространство имен, ключ)
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _expires(ttl):
+        return None if ttl is None else time.time() + ttl
+
+    def _live(self, ns, key, now):
+        entry = self.data.get(ns, {}).get(key)
+        if entry is None or (entry[1] is not None and entry[1] <= now):
+            return None
+        return entry
+
+    def _put(self, ns, key, value, ttl):
+        expires_at = self._expires(ttl)
+        self.data.setdefault(ns, {})[key] = (value, expires_at)
+        if expires_at is not None:
+            heapq.heappush(self.expiry, (expires_at, ns, key))
+        self._expire_due(time.time())
+
+    def _expire_due(self, now):
+        while self.expiry and self.expiry[0][0] <= now:
+            expires_at, ns, key = heapq.heappop(self.expiry)
+            entry = self.data.get(ns, {}).get(key)
+            # Запись уже удалена или перезаписана с другим сроком
+            if entry is not None and entry[1] == expires_at:
+                del self.data[ns][key]
+
+    def get(self, ns, key, default=None):
+        with self.lock:
+            entry = self._live(ns, str(key), time.time())
+            return default if entry is None else entry[0]
+
+    def set(self, ns, key, value, ttl=None):
+        with self.lock:
+            self._put(ns, str(key), value, ttl)
+
+    def set_many(self, ns, values, ttl=None):
+        with self.lock:
+            for key, value in values.items():
+                self._put(ns, str(key), value, ttl)
+
+    def delete(self, ns, key):
+        """Удаляет ключ, возвращает True, если он был"""
+        with self.lock:
+            return self.data.get(ns, {}).pop(str(key), None) is not None
+
+    def add(self, ns, key, value, ttl=None):
+        """Записывает значение, только если ключа нет; True, если записали"""
+        with self.lock:
+            key = str(key)
+            if self._live(ns, key, time.time()) is not None:
+                return False
+            self._put(ns, key, value, ttl)
+            return True
+
+    def incr(self, ns, key, amount=1, ttl=None):
+        """Увеличивает счетчик, возвращает новое значение"""
+        return self.update(ns, key, lambda value: (value or 0) + amount, ttl)
+
+    def update(self, ns, key, fn, ttl=None):
+        """Атомарно заменяет значение на fn(старое или None).
+
+        Если fn вернула None, ключ удаляется. Возвращает новое значение.
+        """
+        with self.lock:
+            key = str(key)
+            entry = self._live(ns, key, time.time())
+            value = fn(None if entry is None else entry[0])
+            if value is None:
+                self.data.get(ns, {}).pop(key, None)
+            else:
+                self._put(ns, key, value, ttl)
+            return value
+
+    def items(self, ns):
+        with self.lock:
+            now = time.time()
+            return [
+                (key, value)
+                for key, (value, expires_at) in self.data.get(ns, {}).items()
+                if expires_at is None or expires_at > now
+            ]
+
+    def purge(self, ns, before=None):
+        """Удаляет записи, истекшие к моменту before, возвращает их ключи"""
+        before = time.time() if before is None else before
+        with self.lock:
+            entries = self.data.get(ns, {})
+            keys = [
+                key
+                for key, (_, expires_at) in entries.items()
+                if expires_at is not None and expires_at <= before
+            ]
+            for key in keys:
+                del entries[key]
+            return keys
+
+
+class SQLiteState:
+    """Состояние в файле SQLite, общее для всех процессов на одной машине.
+
+    Значения хранятся в JSON. add, incr и update выполняются в
+    транзакции BEGIN IMMEDIATE, поэтому атомарны и между процессами.
+    """
+
+    def __init__(self, path="state.db"):
+        self.path = path
+        self.local = threading.local()
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS state (
+                    ns TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    PRIMARY KEY (ns, key)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_state_expires ON state (ns, expires_at)"
+            )
+
+    def connection(self):
+        """Соединение текущего потока"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _expires(ttl):
+        return None if ttl is None else time.time() + ttl
+
+    def _read(self, conn, ns, key):
+        row = conn.execute(
+            "SELECT value FROM state WHERE ns = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (ns, key, time.time()),
+        ).fetchone()
+        return _MISSING if row is None else json.loads(row[0])
+
+    def _write(self, conn, ns, key, value, ttl):
+        conn.execute(
+            "INSERT OR REPLACE INTO state (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (ns, key, json.dumps(value, ensure_ascii=False), self._expires(ttl)),
+        )
+
+    def get(self, ns, key, default=None):
+        value = self._read(self.connection(), ns, str(key))
+        return default if value is _MISSING else value
+
+    def set(self, ns, key, value, ttl=None):
+        self._write(self.connection(), ns, str(key), value, ttl)
+
+    def set_many(self, ns, values, ttl=None):
+        """Записывает несколько значений одной транзакцией"""
+        with self._transaction() as conn:
+            for key, value in values.items():
+                self._write(conn, ns, str(key), value, ttl)
+
+    def delete(self, ns, key):
+        """Удаляет ключ, возвращает True, если он был"""
+        cursor = self.connection().execute(
+            "DELETE FROM state WHERE ns = ? AND key = ?", (ns, str(key))
+        )
+        return cursor.rowcount > 0
+
+    def add(self, ns, key, value, ttl=None):
+        """Записывает значение, только если ключа нет; True, если записали"""
+        with self._transaction() as conn:
+            if self._read(conn, ns, str(key)) is not _MISSING:
+                return False
+            self._write(conn, ns, str(key), value, ttl)
+            return True
+
+    def incr(self, ns, key, amount=1, ttl=None):
+        """Увеличивает счетчик, возвращает новое значение"""
+        return self.update(ns, key, lambda value: (value or 0) + amount, ttl)
+
+    def update(self, ns, key, fn, ttl=None):
+        """Атомарно заменяет значение на fn(старое или None).
+
+        Если fn вернула None, ключ удаляется. Возвращает новое значение.
+        """
+        key = str(key)
+        with self._transaction() as conn:
+            value = self._read(conn, ns, key)
+            value = fn(None if value is _MISSING else value)
+            if value is None:
+                conn.execute("DELETE FROM state WHERE ns = ? AND key = ?", (ns, key))
+            else:
+                self._write(conn, ns, key, value, ttl)
+            return value
+
+    def items(self, ns):
+        rows = self.connection().execute(
+            "SELECT key, value FROM state WHERE ns = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (ns, time.time()),
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def purge(self, ns, before=None):
+        """Удаляет записи, истекшие к моменту before, возвращает их ключи"""
+        before = time.time() if before is None else before
+        with self._transaction() as conn:
+            keys = [
+                key
+                for (key,) in conn.execute(
+                    "SELECT key FROM state WHERE ns = ? AND expires_at <= ?", (ns, before)
+                )
+            ]
+            conn.execute("DELETE FROM state WHERE ns = ? AND expires_at <= ?", (ns, before))
+            return keys
+
+
+def open_state(backend="local", path="state.db"):
+    """Создает хранилище состояния: local - в памяти, sqlite - общее для процессов"""
+    if backend == "local":
+        return LocalState()
+    if backend == "sqlite":
+        logger.info("Общее состояние в %s", path)
+        return SQLiteState(path)
+    raise ValueError(f"Неизвестный тип хранилища состояния: {backend}")
+
+
+class StateMapping(MutableMapping):
+    """Словарь поверх пространства имен хранилища состояния.
+
+    Заменяет LoggedMsgsStore, когда процессов несколько: записи живут
+    ttl секунд, expire() удаляет их так же, как LoggedMsgsStore.expire().
+    """
+
+    def __init__(self, state, ns, ttl):
+        self.state = state
+        self.ns = ns
+        self.ttl = ttl
+
+    def __getitem__(self, key):
+        value = self.state.get(self.ns, key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.state.set(self.ns, key, value, self.ttl)
+
+    def __delitem__(self, key):
+        if not self.state.delete(self.ns, key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.state.get(self.ns, key, _MISSING) is not _MISSING
+
+    def __iter__(self):
+        return iter([key for key, _ in self.state.items(self.ns)])
+
+    def __len__(self):
+        return len(self.state.items(self.ns))
+
+    def items(self):
+        return self.state.items(self.ns)
+
+    def expire(self, older_than):
+        """Удаляет записи, добавленные раньше older_than, возвращает их ключи"""
+        return self.state.purge(self.ns, older_than + self.ttl)
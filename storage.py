@@ -0,0 +1,168 @@
+"""Доступ к SQLite из нескольких потоков"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+WriteResult = namedtuple("WriteResult", ["rowcount", "lastrowid"])
+
+
+class Storage:
+    """База SQLite в режиме WAL.
+
+    Чтение идет через отдельное соединение на каждый поток (sqlite3
+    кеширует подготовленные запросы внутри соединения, поэтому SQL
+    пишется константами). Все записи выполняет один поток: задания,
+    пришедшие почти одновременно, фиксируются одним COMMIT.
+
+    migrations - список SQL-строк или функций f(conn); номер последней
+    примененной миграции хранится в PRAGMA user_version.
+    """
+
+    def __init__(self, path, migrations=(), batch_window=0.005, max_batch=100):
+        self.path = path
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.local = threading.local()
+        self.jobs = queue.Queue()
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        self.commits = 0
+        self.writes = 0
+        self.migrate(migrations)
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def connection(self):
+        """Соединение текущего потока"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self.local.conn = conn
+        return conn
+
+    def migrate(self, migrations):
+        """Применяет миграции, которых еще нет в базе"""
+        conn = self._connect()
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(migrations, start=1):
+                if number <= version:
+                    continue
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if callable(migration):
+                        migration(conn)
+                    else:
+                        for statement in migration.split(";"):
+                            if statement.strip():
+                                conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {number}")
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                logger.info("Применена миграция базы №%s", number)
+        finally:
+            conn.close()
+
+    def query(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def write(self, sql, params=()):
+        """Выполняет запись и ждет фиксации, возвращает WriteResult"""
+        return self.transaction([(sql, params)])[0]
+
+    def transaction(self, statements):
+        """Выполняет несколько записей атомарно, возвращает список WriteResult"""
+        return self.submit(statements).result()
+
+    def submit(self, statements):
+        """Ставит записи в очередь без ожидания, возвращает Future"""
+        future = Future()
+        self._ensure_writer()
+        self.jobs.put((list(statements), future))
+        return future
+
+    def _ensure_writer(self):
+        if self.writer is not None and self.writer.is_alive():
+            return
+        with self.writer_lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(
+                    target=self._writer_loop, name="sqlite-writer", daemon=True
+                )
+                self.writer.start()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        while True:
+            batch = [self.jobs.get()]
+            # Собираем задания, пришедшие за окно группировки
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.jobs.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._commit_batch(conn, batch)
+
+    def _commit_batch(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for statements, future in batch:
+                # Ошибка одного задания откатывает только его
+                conn.execute("SAVEPOINT job")
+                try:
+                    job_results = []
+                    for sql, params in statements:
+                        cursor = conn.execute(sql, params)
+                        job_results.append(WriteResult(cursor.rowcount, cursor.lastrowid))
+                    conn.execute("RELEASE job")
+                    results.append((future, job_results, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    results.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error("Ошибка записи в базу: %s", e)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.commits += 1
+        self.writes += len(batch)
+        for future, job_results, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(job_results)
+
+    def stats(self):
+        return {
+            "commits": self.commits,
+            "writes": self.writes,
+            "pending": self.jobs.qsize(),
+        }
@@ -0,0 +1,163 @@
+"""Неблокирующее логирование: очередь, JSON-записи и одна запись на update
+
+Обработчики вебхука только кладут запись в очередь. Форматирование и
+запись в bot.log идут в отдельном потоке QueueListener, поэтому всплеск
+update не ждет диска.
+
+Ротацию по размеру делает сам процесс, только если он пишет в файл один.
+Несколько WSGI-процессов пишут в общий файл в режиме дозаписи без своей
+ротации: каждый переименовывал бы файл независимо и терял строки
+соседей. Такой файл ротируется снаружи (logrotate), а обработчик
+переоткрывает его, когда файл подменили.
+"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON; поля из extra={"fields": {...}} попадают в корень"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в потоке, который пишет в лог.
+
+    Стандартный prepare() собирает сообщение сразу; здесь в очередь
+    уходит сама запись, а %-подстановка выполняется уже в потоке
+    QueueListener. Трейсбек сохраняется текстом сразу, пока он есть.
+    """
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+
+def setup_logging(
+    level="INFO", path="bot.log", max_bytes=5 * 1024 * 1024, backups=3, shared=False
+):
+    """Настраивает корневой логгер: очередь -> bot.log в JSON (+ WARNING и выше в stderr).
+
+    Повторный вызов ничего не делает. Пустой path - только stderr.
+    shared=True или max_bytes=0 - файл без своей ротации (WatchedFileHandler),
+    для нескольких процессов и внешнего logrotate.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    handlers = []
+    external_rotation = bool(path) and (shared or not max_bytes)
+    if path:
+        if external_rotation:
+            file_handler = logging.handlers.WatchedFileHandler(path, encoding="utf-8")
+        else:
+            file_handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8"
+            )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    # С файлом в stderr идут только предупреждения и ошибки
+    stream_handler.setLevel(logging.WARNING if path else logging.NOTSET)
+    handlers.append(stream_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(LazyQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Дописываем очередь при остановке процесса
+    atexit.register(_listener.stop)
+    if external_rotation and max_bytes:
+        logging.getLogger(__name__).info(
+            "Общий файл лога %s: встроенная ротация отключена, ротируйте его снаружи", path
+        )
+    return _listener
+
+
+class ChatSampler:
+    """Решает, писать ли подробный payload: первое и каждое every-е update чата.
+
+    every=0 отключает подробные записи, every=1 пишет все.
+    """
+
+    def __init__(self, every=20, max_chats=10000):
+        self.every = every
+        self.max_chats = max_chats
+        self.counts = {}  # chat_id -> сколько update видели
+        self.lock = threading.Lock()
+
+    def take(self, chat_id):
+        if self.every <= 0:
+            return False
+        with self.lock:
+            if len(self.counts) >= self.max_chats and chat_id not in self.counts:
+                # Счетчики только для выборки, точность после сброса не важна
+                self.counts.clear()
+            count = self.counts.get(chat_id, 0)
+            self.counts[chat_id] = count + 1
+        return count % self.every == 0
+
+
+@contextmanager
+def update_record(logger, **fields):
+    """Собирает одну запись лога на update: note() внутри дописывает поля.
+
+    Запись уходит при выходе из блока, вместе с длительностью и ошибкой,
+    если она была. Вложенный вызов дописывает поля во внешнюю запись.
+    """
+    current = getattr(_local, "fields", None)
+    if current is not None:
+        current.update(fields)
+        yield current
+        return
+    record = dict(fields)
+    _local.fields = record
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _local.fields = None
+        record["ms"] = round((time.perf_counter() - start) * 1000, 2)
+        logger.info("update", extra={"fields": record})
+
+
+def note(**fields):
+    """Добавляет поля в запись текущего update (вне update_record ничего не делает)"""
+    record = getattr(_local, "fields", None)
+    if record is not None:
+        record.update(fields)
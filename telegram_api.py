@@ -0,0 +1,107 @@
+"""Клиент Telegram Bot API с общим пулом соединений"""
+import logging
+import os
+import threading
+import time
+
+from metrics import TELEGRAM_ERRORS, TELEGRAM_SECONDS
+
+logger = logging.getLogger(__name__)
+
+API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+
+class TelegramAPI:
+    """Все исходящие запросы к Telegram идут через этот клиент.
+
+    Сессия держит keep-alive соединения, поэтому TLS-рукопожатие
+    делается один раз на соединение, а не на каждый вызов. Сессия (и
+    сам requests) создается при первом вызове, а не при запуске.
+    """
+
+    def __init__(self, token, timeout=10, retries=3, backoff=0.5, pool_size=10):
+        self.base_url = f"{API_URL}/bot{token}"
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._session = None
+        self.session_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.latency = {}  # метод -> {"count", "errors", "total", "max"}
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self.session_lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    def _create_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        session = requests.Session()
+        # Повторяем только то, что точно не дошло до Telegram: ошибки соединения
+        # и ответы прокси 502/503/504. Таймаут чтения не повторяем, чтобы не
+        # отправить сообщение дважды. 429 обрабатывает вызывающая сторона.
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=None,
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def call(self, method, payload=None, timeout=None):
+        """Вызов метода Bot API, возвращает разобранный JSON ответа"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.post(
+                f"{self.base_url}/{method}",
+                json=payload,
+                timeout=timeout or self.timeout,
+            )
+            result = response.json()
+            ok = bool(result.get("ok"))
+            return result
+        finally:
+            self.record(method, time.perf_counter() - start, ok)
+
+    def record(self, method, elapsed, ok=True):
+        """Учет задержки по методу Telegram"""
+        TELEGRAM_SECONDS.observe(elapsed, method)
+        if not ok:
+            TELEGRAM_ERRORS.inc(method)
+        with self.stats_lock:
+            stat = self.latency.setdefault(
+                method, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0}
+            )
+            stat["count"] += 1
+            stat["total"] += elapsed
+            stat["max"] = max(stat["max"], elapsed)
+            if not ok:
+                stat["errors"] += 1
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                method: {
+                    **stat,
+                    "avg": stat["total"] / stat["count"] if stat["count"] else 0.0,
+                }
+                for method, stat in self.latency.items()
+            }
@@ -0,0 +1,40 @@
+"""Проверки CommentSelector: веса без повторов подряд"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from comment_selector import CommentSelector  # noqa: E402
+
+
+def _repeats(picks):
+    return sum(1 for prev, item in zip(picks, picks[1:]) if prev == item)
+
+
+def test_skewed_weights_no_consecutive_repeats():
+    selector = CommentSelector(rng=random.Random(1))
+    selector.set_items("text", ["a", "b", "c", "d"], weights=[4, 2, 1, 1])
+    picks = [selector.pick(1, "text") for _ in range(800)]
+    assert _repeats(picks) == 0
+    # Доли по-прежнему соответствуют весам: 4 из 8
+    assert picks.count("a") == 400
+
+
+def test_added_item_not_inserted_next_to_itself():
+    selector = CommentSelector(rng=random.Random(2))
+    selector.set_items("text", ["a", "b", "c", "d"])
+    picks = [selector.pick(1, "text") for _ in range(2)]
+    selector.add("text", "e", weight=2)
+    picks += [selector.pick(1, "text") for _ in range(300)]
+    assert _repeats(picks) == 0
+
+
+def test_unavoidable_repeats_are_minimal():
+    # "a" - 3 из 5: на стыке мешков повтор неизбежен, но только один на мешок
+    selector = CommentSelector(rng=random.Random(3))
+    selector.set_items("text", ["a", "b", "c"], weights=[3, 1, 1])
+    picks = [selector.pick(1, "text") for _ in range(500)]
+    assert _repeats(picks) <= 100
+    for start in range(0, 500, 5):
+        assert _repeats(picks[start:start + 5]) == 0
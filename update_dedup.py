@@ -0,0 +1,100 @@
+"""Защита от повторной обработки update при повторной доставке Telegram"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def create_processed_updates_table(conn):
+    """Миграция: таблица обработанных update_id"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY,
+            received_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_processed_updates_received ON processed_updates (received_at)"
+    )
+
+
+class UpdateDeduplicator:
+    """Окно последних update_id.
+
+    В памяти хранится не больше window идентификаторов. Если передана
+    база, update_id дополнительно записывается в processed_updates:
+    так окно переживает перезапуск и общее для нескольких процессов.
+    Записи старше ttl секунд из базы удаляются.
+    """
+
+    def __init__(self, window=10000, db=None, ttl=24 * 60 * 60, prune_every=1000):
+        self.window = window
+        self.db = db
+        self.ttl = ttl
+        self.prune_every = prune_every
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+        self.claims = 0
+        self.hits = 0
+
+    def claim(self, update_id):
+        """True, если update пришел впервые и его нужно обработать"""
+        if update_id is None:
+            return True
+        with self.lock:
+            if update_id in self.seen:
+                self.hits += 1
+                return False
+            self._remember(update_id)
+            self.claims += 1
+            prune = self.db is not None and self.claims % self.prune_every == 0
+        if self.db is None:
+            return True
+        try:
+            result = self.db.write(
+                "INSERT OR IGNORE INTO processed_updates (update_id, received_at) VALUES (?, ?)",
+                (update_id, time.time()),
+            )
+        except Exception as e:
+            # База недоступна - полагаемся на окно в памяти
+            logger.error("Ошибка записи update_id %s: %s", update_id, e)
+            return True
+        if prune:
+            self.db.submit([
+                ("DELETE FROM processed_updates WHERE received_at < ?", (time.time() - self.ttl,))
+            ])
+        if not result.rowcount:
+            # Update уже принял другой процесс
+            with self.lock:
+                self.hits += 1
+            return False
+        return True
+
+    def release(self, update_id):
+        """Забывает update_id, чтобы повторная доставка была обработана"""
+        if update_id is None:
+            return
+        with self.lock:
+            self.seen.pop(update_id, None)
+        if self.db is not None:
+            self.db.submit([
+                ("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
+            ])
+
+    def _remember(self, update_id):
+        self.seen[update_id] = None
+        while len(self.seen) > self.window:
+            self.seen.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "window": len(self.seen),
+                "claims": self.claims,
+                "hits": self.hits,
+                "persistent": self.db is not None,
+            }
@@ -0,0 +1,98 @@
+"""Очередь входящих обновлений Telegram с пулом обработчиков"""
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def get_update_chat_id(update):
+    """Возвращает chat_id, к которому относится update (или None)"""
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if key in update:
+            return update[key].get("chat", {}).get("id")
+    if "callback_query" in update:
+        message = update["callback_query"].get("message") or {}
+        return message.get("chat", {}).get("id")
+    return None
+
+
+class UpdateQueue:
+    """Ограниченная очередь обновлений.
+
+    Каждый чат закреплен за одним обработчиком, поэтому обновления
+    одного чата обрабатываются строго по порядку.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        # Общий лимит делим между обработчиками
+        per_worker = max(1, int(maxsize) // self.workers)
+        self.queues = [queue.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self.threads = []
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+
+    def start(self):
+        """Запускает обработчики (повторный вызов безопасен)"""
+        with self.lock:
+            if self.threads and all(t.is_alive() for t in self.threads):
+                return
+            self.threads = []
+            for num, q in enumerate(self.queues):
+                thread = threading.Thread(
+                    target=self._worker, args=(q,), name=f"update-worker-{num}", daemon=True
+                )
+                thread.start()
+                self.threads.append(thread)
+            logger.info("Запущено обработчиков очереди: %s", self.workers)
+
+    def submit(self, update):
+        """Ставит update в очередь, возвращает False если очередь переполнена"""
+        if not self.threads:
+            self.start()
+        chat_id = get_update_chat_id(update)
+        q = self.queues[hash(chat_id) % self.workers]
+        try:
+            q.put_nowait(update)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            logger.warning("Очередь переполнена, update %s отброшен", update.get("update_id"))
+            return False
+        with self.lock:
+            self.accepted += 1
+        return True
+
+    def _worker(self, q):
+        while True:
+            update = q.get()
+            try:
+                self.handler(update)
+                with self.lock:
+                    self.processed += 1
+            except Exception as e:
+                with self.lock:
+                    self.failed += 1
+                logger.error("Ошибка обработки update в очереди: %s", e, exc_info=True)
+            finally:
+                q.task_done()
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "depth": self.depth(),
+                "per_worker_depth": [q.qsize() for q in self.queues],
+                "accepted": self.accepted,
+                "dropped": self.dropped,
+                "processed": self.processed,
+                "failed": self.failed,
+            }